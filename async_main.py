@@ -0,0 +1,208 @@
+'''
+Asyncio interface for the social network project
+
+AsyncUserCollection and AsyncUserStatusCollection wrap the synchronous
+collections, and the coroutines below mirror the functions in main.
+Calls run on a bounded thread pool over the shared, pooled MongoClient,
+so one event loop can keep hundreds of operations in flight while
+validation, caching and the user index behave exactly as in main.
+'''
+# pylint: disable=R0903
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import main
+
+
+class AsyncRunner:
+    '''
+    Runs blocking calls on a bounded thread pool
+
+    max_workers bounds the number of calls running against the database at
+    once and max_in_flight bounds the number of calls waiting for a thread.
+    '''
+
+    def __init__(self, max_workers=64, max_in_flight=1024):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='socialnetwork')
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def run(self, func, *args, **kwargs):
+        '''
+        Awaits func(*args, **kwargs) run on the thread pool
+        '''
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor,
+                                              functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        '''
+        Waits for running calls and stops the thread pool
+        '''
+        self.executor.shutdown(wait=True)
+
+
+class AsyncUserCollection:
+    '''
+    Awaitable wrapper around a UserCollection
+    '''
+
+    def __init__(self, collection, runner=None):
+        self.collection = collection
+        self.runner = runner or AsyncRunner()
+
+    async def add_user(self, user_id, email, user_name, user_last_name):
+        '''
+        Adds a new user to the collection
+        '''
+        return await self.runner.run(self.collection.add_user,
+                                     user_id, email, user_name, user_last_name)
+
+    async def modify_user(self, user_id, email, user_name, user_last_name):
+        '''
+        Modifies an existing user
+        '''
+        return await self.runner.run(self.collection.modify_user,
+                                     user_id, email, user_name, user_last_name)
+
+    async def delete_user(self, user_id):
+        '''
+        Deletes an existing user
+        '''
+        return await self.runner.run(self.collection.delete_user, user_id)
+
+    async def search_user(self, user_id):
+        '''
+        Searches for user data
+        '''
+        return await self.runner.run(self.collection.search_user, user_id)
+
+
+class AsyncUserStatusCollection:
+    '''
+    Awaitable wrapper around a UserStatusCollection
+    '''
+
+    def __init__(self, collection, runner=None):
+        self.collection = collection
+        self.runner = runner or AsyncRunner()
+
+    async def add_status(self, status_id, user_id, status_text):
+        '''
+        add a new status message to the collection
+        '''
+        return await self.runner.run(self.collection.add_status,
+                                     status_id, user_id, status_text)
+
+    async def modify_status(self, status_id, user_id, status_text):
+        '''
+        Modifies a status message
+        '''
+        return await self.runner.run(self.collection.modify_status,
+                                     status_id, user_id, status_text)
+
+    async def delete_status(self, status_id):
+        '''
+        deletes the status message with id, status_id
+        '''
+        return await self.runner.run(self.collection.delete_status, status_id)
+
+    async def search_status(self, status_id):
+        '''
+        Find and return a status message by its status_id
+        '''
+        return await self.runner.run(self.collection.search_status, status_id)
+
+
+def init_collections(mongo, max_workers=64, max_in_flight=1024):
+    '''
+    Creates async user and status collections sharing one AsyncRunner
+    '''
+    runner = AsyncRunner(max_workers, max_in_flight)
+    return (AsyncUserCollection(main.init_user_collection(mongo), runner),
+            AsyncUserStatusCollection(main.init_status_collection(mongo), runner))
+
+
+async def load_users(filename, user_collection, **options):
+    '''
+    Awaitable main.load_users
+    '''
+    return await user_collection.runner.run(main.load_users, filename,
+                                            user_collection.collection, **options)
+
+
+async def load_status_updates(filename, status_collection, **options):
+    '''
+    Awaitable main.load_status_updates
+    '''
+    return await status_collection.runner.run(main.load_status_updates, filename,
+                                              status_collection.collection, **options)
+
+
+async def add_user(user_id, email, user_name, user_last_name, user_collection):
+    '''
+    Awaitable main.add_user
+    '''
+    return await user_collection.runner.run(main.add_user, user_id, email, user_name,
+                                            user_last_name, user_collection.collection)
+
+
+async def update_user(user_id, email, user_name, user_last_name, user_collection):
+    '''
+    Awaitable main.update_user
+    '''
+    return await user_collection.runner.run(main.update_user, user_id, email, user_name,
+                                            user_last_name, user_collection.collection)
+
+
+async def delete_user(user_id, user_collection, status_collection=None):
+    '''
+    Awaitable main.delete_user
+    '''
+    statuses = status_collection.collection if status_collection else None
+    return await user_collection.runner.run(main.delete_user, user_id,
+                                            user_collection.collection, statuses)
+
+
+async def search_user(user_id, user_collection):
+    '''
+    Awaitable main.search_user
+    '''
+    return await user_collection.runner.run(main.search_user, user_id,
+                                            user_collection.collection)
+
+
+async def add_status(user_id, status_id, status_text, status_collection,
+                     user_collection=None):
+    '''
+    Awaitable main.add_status
+    '''
+    users = user_collection.collection if user_collection else None
+    return await status_collection.runner.run(main.add_status, user_id, status_id,
+                                              status_text, status_collection.collection,
+                                              users)
+
+
+async def update_status(status_id, user_id, status_text, status_collection):
+    '''
+    Awaitable main.update_status
+    '''
+    return await status_collection.runner.run(main.update_status, status_id, user_id,
+                                              status_text, status_collection.collection)
+
+
+async def delete_status(status_id, status_collection):
+    '''
+    Awaitable main.delete_status
+    '''
+    return await status_collection.runner.run(main.delete_status, status_id,
+                                              status_collection.collection)
+
+
+async def search_status(status_id, status_collection):
+    '''
+    Awaitable main.search_status
+    '''
+    return await status_collection.runner.run(main.search_status, status_id,
+                                              status_collection.collection)
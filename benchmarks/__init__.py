@@ -0,0 +1,9 @@
+'''
+Benchmarks for the social network project
+
+Run with:
+
+    python -m benchmarks --scale 1k --output results.json
+
+See benchmarks/__main__.py for the options.
+'''
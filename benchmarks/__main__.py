@@ -0,0 +1,173 @@
+'''
+Times CSV loads and CRUD operations against a local mongod
+
+    python -m benchmarks [--scale 1k|100k|10m] [--operations N]
+                         [--host HOST] [--port PORT] [--start-mongod]
+                         [--database NAME] [--force] [--output results.json]
+
+Data goes to a separate benchmark database which is dropped first and
+afterwards. Its name must end in _bench unless --force is given, so a
+real database such as media is never wiped by mistake.
+With --start-mongod, a mongod is started with the repo's
+mongo_config_dev.yml for the duration of the run. Results are printed and
+written as JSON: throughput for loads, and ops/sec with p50/p95/p99
+latency in milliseconds for each CRUD function in main.
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import main
+import socialnetwork_db as sn
+from benchmarks import datasets
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Databases the benchmarks may drop without --force end with this
+BENCH_SUFFIX = '_bench'
+
+
+def summarize(latencies):
+    '''
+    Returns ops/sec and p50/p95/p99 latency in ms for a list of seconds
+    '''
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'count': len(latencies),
+            'ops_per_sec': len(latencies) / sum(latencies),
+            'p50_ms': cuts[49] * 1000,
+            'p95_ms': cuts[94] * 1000,
+            'p99_ms': cuts[98] * 1000}
+
+
+def time_calls(func, argument_lists):
+    '''
+    Calls func once per argument tuple and summarizes the latencies
+    '''
+    latencies = []
+    for arguments in argument_lists:
+        start = time.perf_counter()
+        func(*arguments)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def time_load(loader, filename, collection, rows):
+    '''
+    Times one CSV load and returns its duration and rows/sec
+    '''
+    start = time.perf_counter()
+    result = loader(filename, collection)
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds,
+            'success': bool(result)}
+
+
+def run(mongo, scale, operations, data_dir, force=False):
+    '''
+    Runs every benchmark and returns the results
+
+    Raises ValueError, before anything is dropped, if the database name
+    does not end in BENCH_SUFFIX and force is False.
+    '''
+    # pylint: disable=R0914
+    if not force and not mongo.database.endswith(BENCH_SUFFIX):
+        raise ValueError(f'refusing to drop database {mongo.database}')
+    users_file, statuses_file, users = datasets.build(scale, data_dir)
+    with mongo:
+        mongo.connection.drop_database(mongo.database)
+        user_collection = main.init_user_collection(mongo)
+        status_collection = main.init_status_collection(mongo)
+        results = {
+            'load_users': time_load(main.load_users, users_file, user_collection,
+                                    users),
+            'load_status_updates': time_load(main.load_status_updates, statuses_file,
+                                             status_collection, datasets.SCALES[scale])}
+        new_users = [(f'bench.user{i}', f'bench.user{i}@uw.edu', 'Bench', 'User')
+                     for i in range(operations)]
+        new_statuses = [(user_id, f'{user_id}_{i:05d}', 'Benchmark status')
+                        for i, (user_id, *_) in enumerate(new_users)]
+        crud = [
+            ('add_user', main.add_user,
+             [user + (user_collection,) for user in new_users]),
+            ('update_user', main.update_user,
+             [(user_id, email, 'Changed', last_name, user_collection)
+              for user_id, email, _, last_name in new_users]),
+            ('search_user', main.search_user,
+             [(user_id, user_collection) for user_id, *_ in new_users]),
+            ('add_status', main.add_status,
+             [status + (status_collection,) for status in new_statuses]),
+            ('update_status', main.update_status,
+             [(status_id, user_id, 'Changed status', status_collection)
+              for user_id, status_id, _ in new_statuses]),
+            ('search_status', main.search_status,
+             [(status_id, status_collection) for _, status_id, _ in new_statuses]),
+            ('delete_status', main.delete_status,
+             [(status_id, status_collection) for _, status_id, _ in new_statuses]),
+            ('delete_user', main.delete_user,
+             [(user_id, user_collection) for user_id, *_ in new_users])]
+        for name, func, argument_lists in crud:
+            results[name] = time_calls(func, argument_lists)
+        mongo.connection.drop_database(mongo.database)
+    return results
+
+
+def start_mongod():
+    '''
+    Starts mongod with mongo_config_dev.yml from the repo directory
+    '''
+    os.makedirs(os.path.join(REPO_DIR, 'mongo_files'), exist_ok=True)
+    # pylint: disable=R1732
+    return subprocess.Popen(['mongod', '-f', 'mongo_config_dev.yml'], cwd=REPO_DIR)
+
+
+def main_cli(argv=None):
+    '''
+    Parses the command line, runs the benchmarks and writes the results
+    '''
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--scale', choices=sorted(datasets.SCALES), default='1k')
+    parser.add_argument('--operations', type=int, default=1000,
+                        help='calls timed per CRUD function')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--database', default='media' + BENCH_SUFFIX,
+                        help=f'dropped before and after the run; must end in '
+                             f'{BENCH_SUFFIX} unless --force is given')
+    parser.add_argument('--force', action='store_true',
+                        help=f'drop --database even if it does not end in {BENCH_SUFFIX}')
+    parser.add_argument('--data-dir', default=os.path.join(REPO_DIR, 'benchmarks', 'data'))
+    parser.add_argument('--start-mongod', action='store_true')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+    if not args.force and not args.database.endswith(BENCH_SUFFIX):
+        parser.error(f'--database {args.database} does not end in {BENCH_SUFFIX}; '
+                     'it would be dropped, use --force to allow it')
+    mongod = start_mongod() if args.start_mongod else None
+    try:
+        mongo = sn.MongoDBConnection(args.host, args.port, database=args.database)
+        with mongo:
+            # Wait for the server, which may still be starting
+            mongo.connection.admin.command('ping')
+        results = {'scale': args.scale,
+                   'operations': args.operations,
+                   'python': platform.python_version(),
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'results': run(mongo, args.scale, args.operations, args.data_dir,
+                                      args.force)}
+    finally:
+        sn.close_clients()
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    for name, result in results['results'].items():
+        print(name, json.dumps(result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
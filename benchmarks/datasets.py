@@ -0,0 +1,39 @@
+'''
+Deterministic user and status datasets for the benchmarks
+
+Files are generated with datagen, so the same scale and seed always
+produce the same data.
+'''
+import os
+import datagen
+
+# Number of status rows per scale, with one user per 100 statuses as in
+# the sample accounts.csv/status_updates.csv files
+SCALES = {'1k': 1_000, '100k': 100_000, '10m': 10_000_000}
+
+
+def user_count(scale):
+    '''
+    Number of users generated for scale
+    '''
+    return max(SCALES[scale] // 100, 10)
+
+
+def build(scale, directory, seed=0):
+    '''
+    Writes the users and statuses of scale to directory
+
+    Returns (users file, statuses file, number of users). Existing files
+    are reused since the output is deterministic.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    users_file = os.path.join(directory, f'accounts_{scale}_{seed}.csv')
+    statuses_file = os.path.join(directory, f'status_updates_{scale}_{seed}.csv')
+    users = user_count(scale)
+    if not os.path.exists(users_file):
+        datagen.write_csv(users_file, datagen.USER_HEADER,
+                          datagen.generate_users(users, seed))
+    if not os.path.exists(statuses_file):
+        datagen.write_csv(statuses_file, datagen.STATUS_HEADER,
+                          datagen.generate_statuses(SCALES[scale], users, seed))
+    return users_file, statuses_file, users
@@ -0,0 +1,79 @@
+'''
+Batch helpers shared by UserCollection and UserStatusCollection
+
+Each helper works on many documents per round trip and returns one
+result per input item, in input order.
+'''
+import pymongo
+
+# Number of keys sent in one $in query
+CHUNK_SIZE = 1000
+
+
+def chunks(items, size=CHUNK_SIZE):
+    '''
+    Yields successive lists of at most size items
+    '''
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def insert_documents(database, documents):
+    '''
+    Inserts documents with one unordered insert_many
+
+    Returns a list with True for each inserted document and False for each
+    document that failed, such as on a duplicate key.
+    '''
+    results = [True] * len(documents)
+    if not documents:
+        return results
+    try:
+        database.insert_many(documents, ordered=False)
+    except pymongo.errors.BulkWriteError as exc:
+        for error in exc.details['writeErrors']:
+            results[error['index']] = False
+    return results
+
+
+def find_by_keys(database, field, keys, projection=None, chunk_size=CHUNK_SIZE):
+    '''
+    Returns {key: document} for every key found, using chunked $in queries
+
+    field is always included in a given projection.
+    '''
+    if projection is not None:
+        projection = dict(projection, **{field: 1})
+    found = {}
+    for chunk in chunks(list(set(keys)), chunk_size):
+        for document in database.find({field: {'$in': chunk}}, projection):
+            found[document[field]] = document
+    return found
+
+
+def update_documents(database, field, updates, chunk_size=CHUNK_SIZE):
+    '''
+    Applies {key: $set fields} updates with one bulk_write per chunk
+
+    Returns the set of keys which existed and were updated.
+    '''
+    existing = set(find_by_keys(database, field, updates, {field: 1, '_id': 0},
+                                chunk_size))
+    requests = [pymongo.UpdateOne({field: key}, {'$set': values})
+                for key, values in updates.items() if key in existing]
+    for chunk in chunks(requests, chunk_size):
+        database.bulk_write(chunk, ordered=False)
+    return existing
+
+
+def delete_documents(database, field, keys, chunk_size=CHUNK_SIZE):
+    '''
+    Deletes documents by key with one delete_many per chunk
+
+    Returns the set of keys which existed and were deleted.
+    '''
+    existing = set(find_by_keys(database, field, keys, {field: 1, '_id': 0},
+                                chunk_size))
+    for chunk in chunks(list(existing), chunk_size):
+        database.delete_many({field: {'$in': chunk}})
+    return existing
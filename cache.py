@@ -0,0 +1,89 @@
+'''
+Read-through cache for the social network project collections
+
+Holds recently searched documents so repeated lookups of the same
+user_id or status_id do not touch the database.
+'''
+# pylint: disable=R0902
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Bounded cache with least-recently-used eviction and a time to live
+
+    Entries older than ttl seconds are treated as missing. hits, misses
+    and evictions count cache activity since creation.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        Returns the cached value for key, or None if missing or expired
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < self.clock():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        '''
+        Stores value for key, evicting the least recently used entry
+        '''
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        '''
+        Removes key from the cache
+        '''
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        '''
+        Removes every entry whose value satisfies predicate
+        '''
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items()
+                        if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        '''
+        Removes every entry
+        '''
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        '''
+        Returns the cache counters and current size
+        '''
+        with self.lock:
+            return {'size': len(self.entries),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
@@ -0,0 +1,65 @@
+'''
+Checkpoints for resumable CSV loads
+
+A checkpoint is a small JSON file next to the CSV file which records the
+identity of the file, the byte offset and line after the last inserted
+batch and the number of batches inserted. It is replaced atomically, so
+a crash leaves either the old or the new checkpoint.
+'''
+import json
+import logging
+import os
+
+# Appended to a CSV filename for its resumable load checkpoint
+CHECKPOINT_SUFFIX = '.ckpt'
+
+
+def file_identity(filename, file):
+    '''
+    Returns the path, size and modification time of an open file
+    '''
+    stat = os.fstat(file.fileno())
+    return {'file': os.path.abspath(filename),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def read_checkpoint(checkpoint_file, identity):
+    '''
+    Returns the saved load state, or None if there is none for this file
+
+    A checkpoint written for a different version of the file is ignored.
+    '''
+    try:
+        with open(checkpoint_file, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if any(state.get(key) != value for key, value in identity.items()):
+        logging.warning('Ignoring checkpoint %s for a changed file.', checkpoint_file)
+        return None
+    return state
+
+
+def write_checkpoint(checkpoint_file, state, offset, line):
+    '''
+    Durably records that everything before offset and line is loaded
+
+    The state is written to a temporary file, synced and renamed over the
+    checkpoint, so a crash leaves either the old or the new checkpoint.
+    '''
+    state.update(offset=offset, line=line, batches=state['batches'] + 1)
+    temporary = checkpoint_file + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, checkpoint_file)
+
+
+def remove_checkpoint(checkpoint_file):
+    '''
+    Removes the checkpoint of a finished load, if there is one
+    '''
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
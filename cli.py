@@ -0,0 +1,353 @@
+'''
+Non-interactive command line for the social network project
+
+Runs one operation per invocation over a single pooled MongoDB connection,
+so it can be scripted and used in pipelines where menu.py cannot:
+
+    python cli.py load users accounts.csv
+    python cli.py sync accounts.csv --delete-missing
+    python cli.py add statuses < new_statuses.csv
+    python cli.py search users dave03 evmiles97
+    cut -d, -f1 gone.csv | python cli.py delete users --cascade
+    python cli.py export statuses statuses.jsonl.gz
+    python cli.py migrate
+    python cli.py report top-posters --limit 20
+    python cli.py --port 27018 bench --scale 100k
+
+Bulk input for add is CSV with the same header as the load files; ids for
+search and delete come from the arguments, or one per line from --file or
+stdin. Search results are printed as JSON lines. The exit status is 1 if
+any row or id failed. main and pymongo are only imported once a
+subcommand runs, so --help and usage errors return without loading the
+driver; every subcommand, bench included, loads both.
+
+bench runs python -m benchmarks with the global --host and --port, and
+--database only if it was given: the benchmarks drop their database, which
+is media_bench by default, and refuse a name not ending in _bench unless
+the bench option --force is given.
+'''
+# pylint: disable=C0415,R0903
+import argparse
+import csv
+import itertools
+import json
+import logging
+import sys
+
+# Rows or ids sent to the database per batch
+BATCH_SIZE = 1000
+# Database used when --database is not given
+DATABASE = 'media'
+
+# CSV columns of the records taken by main.add_users and main.add_statuses
+RECORD_COLUMNS = {'users': ('USER_ID', 'EMAIL', 'NAME', 'LASTNAME'),
+                  'statuses': ('STATUS_ID', 'USER_ID', 'STATUS_TEXT')}
+
+
+def batches(items, size):
+    '''
+    Yields successive lists of at most size items from any iterable
+    '''
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_ids(args):
+    '''
+    Yields the ids given as arguments, or else one per line of the input
+    '''
+    if args.ids:
+        yield from args.ids
+        return
+    with open_input(args.file) as file:
+        for line in file:
+            if line.strip():
+                yield line.strip()
+
+
+def open_input(filename):
+    '''
+    Opens filename for reading, or stdin for None or '-'
+    '''
+    if filename in (None, '-'):
+        return open(sys.stdin.fileno(), 'r', encoding='utf-8', newline='', closefd=False)
+    return open(filename, 'r', encoding='utf-8-sig', newline='')
+
+
+class Session:
+    '''
+    The collections of one run, sharing one pooled connection
+    '''
+
+    def __init__(self, mongo):
+        import main
+        self.main = main
+        self.users = main.init_user_collection(mongo)
+        self.statuses = main.init_status_collection(mongo)
+
+    def collection(self, kind):
+        '''
+        Returns the users or statuses collection
+        '''
+        return self.users if kind == 'users' else self.statuses
+
+
+def run_load(session, args):
+    '''
+    Loads a CSV file like menu options A and B
+    '''
+    if args.kind == 'users':
+        result = session.main.load_users(args.filename, session.users, args.batch_size,
+                                         not args.unordered, args.processes, args.resume)
+    else:
+        session.users.build_user_index()
+        result = session.main.load_status_updates(
+            args.filename, session.statuses, args.batch_size, not args.unordered,
+            args.processes, user_collection=session.users, resume=args.resume)
+    success, report = result if isinstance(result, tuple) else (result, None)
+    if report is not None:
+        print(f'{report.inserted} inserted, {len(report.duplicates)} duplicates, '
+              f'{len(report.errors)} errors')
+    return success
+
+
+def run_sync(session, args):
+    '''
+    Syncs the users collection with an accounts CSV snapshot
+    '''
+    success, counts = session.main.sync_users(
+        args.filename, session.users, args.batch_size, args.delete_missing,
+        session.statuses if args.delete_missing else None)
+    print(', '.join(f'{count} {name}' for name, count in counts.items()))
+    return success
+
+
+def run_add(session, args):
+    '''
+    Adds the users or statuses read from a CSV file or stdin
+    '''
+    columns = RECORD_COLUMNS[args.kind]
+    if args.kind == 'users':
+        add = session.main.add_users
+        options = {}
+    else:
+        session.users.build_user_index()
+        add = session.main.add_statuses
+        options = {'user_collection': session.users}
+    added = failed = 0
+    with open_input(args.file) as file:
+        records = (tuple(row.get(column) or '' for column in columns)
+                   for row in csv.DictReader(file))
+        for batch in batches(records, args.batch_size):
+            results = add(batch, session.collection(args.kind), **options)
+            added += sum(results)
+            failed += len(results) - sum(results)
+    print(f'{added} added, {failed} failed')
+    return not failed
+
+
+def run_search(session, args):
+    '''
+    Prints the users or statuses found for the ids as JSON lines
+    '''
+    search = session.main.search_users if args.kind == 'users' \
+        else session.main.search_statuses
+    missing = 0
+    for batch in batches(read_ids(args), args.batch_size):
+        for item_id, found in zip(batch, search(batch, session.collection(args.kind))):
+            if found is None:
+                missing += 1
+                logging.warning('%s not found.', item_id)
+                continue
+            print(json.dumps(dict(found)))
+    return not missing
+
+
+def run_delete(session, args):
+    '''
+    Deletes the users or statuses with the given ids
+    '''
+    deleted = missing = 0
+    for batch in batches(read_ids(args), args.batch_size):
+        if args.kind == 'users':
+            results = session.main.delete_users(
+                batch, session.users, session.statuses if args.cascade else None)
+        else:
+            results = session.main.delete_statuses(batch, session.statuses)
+        deleted += sum(results)
+        missing += len(results) - sum(results)
+    print(f'{deleted} deleted, {missing} not found')
+    return not missing
+
+
+def run_export(session, args):
+    '''
+    Exports the users or statuses collection to a file
+    '''
+    export = session.main.export_users if args.kind == 'users' \
+        else session.main.export_statuses
+    return export(args.filename, session.collection(args.kind), args.format,
+                  args.compression)
+
+
+def run_migrate(session, args):
+    '''
+    Applies pending schema migrations to both collections
+    '''
+    import migrations
+    database = session.users.database.database
+    for line in migrations.migrate_all(database, args.batch_size, args.offline,
+                                       args.drop_indexes):
+        print(line)
+    return True
+
+
+def run_report(session, args):
+    '''
+    Prints an aggregation report as JSON lines
+    '''
+    if args.report == 'status-counts':
+        results = session.main.status_counts(session.statuses, args.batch_size)
+    elif args.report == 'top-posters':
+        results = session.main.top_posters(session.statuses, session.users, args.limit)
+    else:
+        results = session.main.inactive_users(session.users, session.statuses,
+                                              args.batch_size)
+    for result in results:
+        print(json.dumps(dict(result)))
+    return True
+
+
+COMMANDS = {'load': run_load,
+            'sync': run_sync,
+            'add': run_add,
+            'search': run_search,
+            'delete': run_delete,
+            'export': run_export,
+            'migrate': run_migrate,
+            'report': run_report}
+
+
+def add_migrate_arguments(parser):
+    '''
+    Adds the --offline and --drop-indexes options of migrate to a parser
+
+    Shared with python migrations.py, and defined here so that building
+    the cli parser does not import migrations and the driver.
+    '''
+    parser.add_argument('--offline', action='store_true',
+                        help='allow moving documents without transactions; '
+                             'other writers must be stopped')
+    parser.add_argument('--drop-indexes', action='store_true',
+                        help='drop the unique key indexes made redundant by the '
+                             'migration, once old processes have restarted')
+
+
+def build_parser():
+    '''
+    Returns the argument parser for every subcommand
+    '''
+    parser = argparse.ArgumentParser(description='Social network database commands.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--database', help=f'default {DATABASE}; media_bench for bench')
+    parser.add_argument('--log-file', help='write INFO logs to this file')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    commands = parser.add_subparsers(dest='command', required=True)
+    kinds = ('users', 'statuses')
+
+    load = commands.add_parser('load', help='load a CSV file')
+    load.add_argument('kind', choices=kinds)
+    load.add_argument('filename')
+    load.add_argument('--processes', type=int,
+                      help='load with this many worker processes, always unordered')
+    load.add_argument('--resume', action='store_true',
+                      help='checkpoint each batch and continue a stopped load, '
+                           'always unordered')
+    load.add_argument('--unordered', action='store_true')
+
+    sync = commands.add_parser('sync', help='sync users with an accounts CSV snapshot')
+    sync.add_argument('filename')
+    sync.add_argument('--delete-missing', action='store_true')
+
+    add = commands.add_parser('add', help='add CSV rows from a file or stdin')
+    add.add_argument('kind', choices=kinds)
+    add.add_argument('file', nargs='?')
+
+    for name in ('search', 'delete'):
+        command = commands.add_parser(name, help=f'{name} ids from arguments or stdin')
+        command.add_argument('kind', choices=kinds)
+        command.add_argument('ids', nargs='*')
+        command.add_argument('--file', help='read ids from this file instead of stdin')
+    commands.choices['delete'].add_argument('--cascade', action='store_true',
+                                            help='also delete the statuses of users')
+
+    export = commands.add_parser('export', help='export a collection')
+    export.add_argument('kind', choices=kinds)
+    export.add_argument('filename')
+    export.add_argument('--format', choices=('csv', 'jsonl'))
+    export.add_argument('--compression', choices=('gzip', 'zstd'))
+
+    add_migrate_arguments(commands.add_parser('migrate',
+                                              help='apply pending schema migrations'))
+
+    report = commands.add_parser('report', help='run an aggregation report')
+    report.add_argument('report', choices=('status-counts', 'top-posters', 'inactive'))
+    report.add_argument('--limit', type=int, default=10, help='number of top posters')
+
+    commands.add_parser('bench', help='run the benchmark suite; other options '
+                                      'are passed to python -m benchmarks')
+    return parser
+
+
+def parse_args(argv=None):
+    '''
+    Parses the command line, keeping unknown bench options in bench_args
+    '''
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and args.command != 'bench':
+        parser.error(f'unrecognized arguments: {" ".join(extra)}')
+    args.bench_args = extra
+    return args
+
+
+def bench_argv(args):
+    '''
+    Returns the benchmark arguments, led by the global connection options
+    '''
+    options = ['--host', args.host, '--port', str(args.port)]
+    if args.database is not None:
+        options += ['--database', args.database]
+    return options + args.bench_args
+
+
+def main_cli(argv=None):
+    '''
+    Parses the command line, runs one subcommand and returns the exit status
+    '''
+    args = parse_args(argv)
+    if args.command == 'bench':
+        from benchmarks import __main__ as bench
+        return bench.main_cli(bench_argv(args))
+    if args.log_file:
+        import log_config
+        log_config.configure_logging(args.log_file, console=False)
+    else:
+        logging.basicConfig(level=logging.WARNING, format=logging.BASIC_FORMAT)
+    import socialnetwork_db
+    try:
+        with socialnetwork_db.MongoDBConnection(args.host, args.port,
+                                                database=args.database or DATABASE) as mongo:
+            success = COMMANDS[args.command](Session(mongo), args)
+    finally:
+        socialnetwork_db.close_clients()
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,162 @@
+'''
+Deterministic synthetic data generator for the social network project
+
+Streams accounts.csv and status_updates.csv format files of any size:
+rows are generated one at a time from a seeded RNG, so the same arguments
+always give the same files and memory use does not depend on the row
+count. Generated rows pass validate_user_id, validate_email,
+validate_name and validate_status_id, except for a chosen fraction of
+invalid rows and of rows repeating an earlier id.
+
+    python datagen.py --users 1000000 --statuses 100000000 --seed 1 \\
+        --invalid 0.001 --duplicates 0.001 --output-dir data
+'''
+import argparse
+import collections
+import csv
+import os
+import random
+
+USER_HEADER = ['USER_ID', 'NAME', 'LASTNAME', 'EMAIL']
+STATUS_HEADER = ['STATUS_ID', 'USER_ID', 'STATUS_TEXT']
+
+FIRST_NAMES = ['Brittaney', 'Keri', 'David', 'Eve', 'Marcus', 'Kathleen', 'Andy',
+               'Maria', 'Anne-Marie', 'Jean-Luc', 'Zoe', 'Ravi']
+LAST_NAMES = ['Gentry', 'Royce', 'Yuen', 'Miles', 'Bakke', 'Wong', 'Lee',
+              "O'Neil", 'Smith-Jones', 'Nguyen', 'Garcia', 'Okafor']
+DOMAINS = ['goodmail.com', 'funmail.com', 'uw.edu', 'example.org']
+WORDS = ['sunny', 'seattle', 'code', 'finally', 'compiling', 'perfect', 'hike',
+         'weather', 'coffee', 'homework', 'again', 'today', 'mongo', 'python']
+
+# Number of recent ids kept to draw duplicates from
+RECENT_IDS = 1000
+
+
+def user_id(index):
+    '''
+    Returns the user_id of the user generated at index
+    '''
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    return f'{first}.{last.replace(chr(39), "")}{index}'
+
+
+def invalid_user(rng, row):
+    '''
+    Breaks one field of a valid user row
+    '''
+    field = rng.randrange(5)
+    if field == 0:
+        row[0] = str(rng.randrange(10 ** 6))
+    elif field == 1:
+        row[0] = row[0].replace('.', ' ')
+    elif field == 2:
+        row[1] = row[1] + '3000'
+    elif field == 3:
+        row[3] = row[3].replace('@', '')
+    else:
+        row[rng.randrange(4)] = ' '
+    return row
+
+
+def invalid_status(rng, row):
+    '''
+    Breaks one field of a valid status row
+    '''
+    field = rng.randrange(3)
+    if field == 0:
+        row[0] = row[0].split('_')[0]
+    elif field == 1:
+        row[0] = row[0] + '_x'
+    else:
+        row[rng.randrange(3)] = ''
+    return row
+
+
+def generate_users(count, seed=0, invalid=0.0, duplicates=0.0):
+    '''
+    Yields count rows in accounts.csv column order
+
+    A fraction invalid of the rows have one invalid field and a fraction
+    duplicates reuse the USER_ID of a recent row.
+    '''
+    rng = random.Random(seed)
+    recent = collections.deque(maxlen=RECENT_IDS)
+    for index in range(count):
+        new_id = user_id(index)
+        first = FIRST_NAMES[index % len(FIRST_NAMES)]
+        last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        row = [new_id, first, last, f'{new_id}@{rng.choice(DOMAINS)}']
+        draw = rng.random()
+        if draw < invalid:
+            row = invalid_user(rng, row)
+        elif draw < invalid + duplicates and recent:
+            row[0] = rng.choice(recent)
+        else:
+            recent.append(new_id)
+        yield row
+
+
+def generate_statuses(count, user_count, seed=0, invalid=0.0, duplicates=0.0):
+    '''
+    Yields count rows in status_updates.csv column order
+
+    Each status belongs to one of the first user_count generated users and
+    its id ends in the row number, so ids are unique. A fraction invalid of
+    the rows have one invalid field and a fraction duplicates reuse the
+    STATUS_ID of a recent row.
+    '''
+    rng = random.Random(seed)
+    recent = collections.deque(maxlen=RECENT_IDS)
+    for index in range(count):
+        owner = user_id(rng.randrange(user_count))
+        status_id = f'{owner}_{index + 1:05d}'
+        row = [status_id, owner, ' '.join(rng.choices(WORDS, k=rng.randint(3, 12)))]
+        draw = rng.random()
+        if draw < invalid:
+            row = invalid_status(rng, row)
+        elif draw < invalid + duplicates and recent:
+            row[0] = rng.choice(recent)
+        else:
+            recent.append(status_id)
+        yield row
+
+
+def write_csv(filename, header, rows):
+    '''
+    Streams rows to a CSV file and returns the number written
+    '''
+    written = 0
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+    return written
+
+
+def main_cli(argv=None):
+    '''
+    Parses the command line and writes the requested files
+    '''
+    parser = argparse.ArgumentParser(description='Generate social network CSV files.')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--statuses', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--invalid', type=float, default=0.0,
+                        help='fraction of rows with an invalid field')
+    parser.add_argument('--duplicates', type=float, default=0.0,
+                        help='fraction of rows repeating a recent id')
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_csv(os.path.join(args.output_dir, 'accounts.csv'), USER_HEADER,
+              generate_users(args.users, args.seed, args.invalid, args.duplicates))
+    write_csv(os.path.join(args.output_dir, 'status_updates.csv'), STATUS_HEADER,
+              generate_statuses(args.statuses, args.users, args.seed,
+                                args.invalid, args.duplicates))
+
+
+if __name__ == '__main__':
+    main_cli()
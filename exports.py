@@ -0,0 +1,99 @@
+'''
+Streaming export of the social network collections
+
+A collection is written to CSV, in the layout the loaders read, or to
+JSON Lines, optionally gzip or zstd compressed. Documents are written as
+the cursor returns them, so memory use does not depend on the collection
+size.
+'''
+import csv
+import gzip
+import json
+import logging
+import os
+
+# Documents fetched per cursor batch when exporting
+EXPORT_BATCH_SIZE = 10000
+# Formats and compressions export_collection can write
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_COMPRESSIONS = (None, 'gzip', 'zstd')
+# File name suffixes of the export compressions
+COMPRESSION_SUFFIXES = {'gz': 'gzip', 'zst': 'zstd'}
+
+
+def export_collection(filename, collection, columns, fmt=None, compression=None,
+                      batch_size=EXPORT_BATCH_SIZE):
+    # pylint: disable=R0913,R0917
+    '''
+    Streams a collection to a CSV or JSON Lines file
+
+    Only the fields in columns are fetched, batch_size documents per
+    cursor batch, and each document is written as soon as it arrives, so
+    memory use does not depend on the collection size. fmt and compression
+    default to the suffixes of the file name, see export_format; an
+    unknown format or compression returns False without writing anything.
+    '''
+    fmt, compression = export_format(filename, fmt, compression)
+    if fmt not in EXPORT_FORMATS or compression not in EXPORT_COMPRESSIONS:
+        logging.error('Unable to export %s to %s: unknown format %s or compression %s',
+                      collection.name, filename, fmt, compression)
+        return False
+    keys = [key for _, key in columns]
+    projection = dict.fromkeys(keys, 1)
+    projection['_id'] = 0
+    try:
+        with open_export(filename, compression) as file:
+            cursor = collection.database.find({}, projection, batch_size=batch_size)
+            count = 0
+            if fmt == 'csv':
+                writer = csv.writer(file)
+                writer.writerow([column for column, _ in columns])
+                for document in cursor:
+                    writer.writerow([document.get(key, '') for key in keys])
+                    count += 1
+            else:
+                for document in cursor:
+                    file.write(json.dumps(document) + '\n')
+                    count += 1
+    except (OSError, ImportError) as exc:
+        logging.error('Unable to export %s to %s: %s', collection.name, filename, exc)
+        return False
+    logging.info('Exported %i %s documents to %s.', count, collection.name, filename)
+    return True
+
+
+def export_format(filename, fmt=None, compression=None):
+    '''
+    Returns (fmt, compression) with the missing values taken from the
+    suffixes of the file name
+
+    The name ends in the format, csv or jsonl, optionally followed by the
+    compression, gz or zst. A name without a known format suffix gives the
+    format None, which export_collection rejects.
+    '''
+    suffixes = os.path.basename(filename).lower().split('.')[1:]
+    name_compression = None
+    if suffixes and suffixes[-1] in COMPRESSION_SUFFIXES:
+        name_compression = COMPRESSION_SUFFIXES[suffixes.pop()]
+    name_fmt = suffixes[-1] if suffixes and suffixes[-1] in EXPORT_FORMATS else None
+    return fmt or name_fmt, compression or name_compression
+
+
+def open_export(filename, compression=None):
+    '''
+    Opens filename for writing text, optionally gzip or zstd compressed
+
+    zstd needs Python 3.14's compression.zstd or the zstandard package.
+    '''
+    # pylint: disable=C0415,E0401
+    if compression is None:
+        return open(filename, 'w', encoding='utf-8', newline='')
+    if compression == 'gzip':
+        return gzip.open(filename, 'wt', encoding='utf-8', newline='')
+    if compression == 'zstd':
+        try:
+            from compression import zstd
+        except ImportError:
+            import zstandard as zstd
+        return zstd.open(filename, 'wt', encoding='utf-8', newline='')
+    raise ValueError(f'Unknown compression {compression}')
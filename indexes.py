@@ -0,0 +1,105 @@
+'''
+Index lifecycle management for the social network project collections
+
+Each collection declares the indexes it needs. ensure_indexes applies
+them once per process with a single create_indexes call, and only when
+the indexes on the server do not already match. index_report uses
+$indexStats to point out indexes that are unused, undeclared or made
+redundant by another index.
+'''
+import logging
+import threading
+from pymongo import ASCENDING, TEXT, IndexModel
+
+USER_INDEXES = [IndexModel([('user_id', ASCENDING)], name='user_id_1', unique=True)]
+
+STATUS_INDEXES = [IndexModel([('status_id', ASCENDING)], name='status_id_1', unique=True),
+                  IndexModel([('user_id', ASCENDING), ('status_seq', ASCENDING),
+                              ('status_id', ASCENDING)],
+                             name='user_id_1_status_seq_1_status_id_1'),
+                  IndexModel([('status_text', TEXT)], name='status_text_text')]
+
+# Indexes created by earlier versions which are dropped when found.
+# status_text_1 is a B-tree on free text which is never queried by equality,
+# and user_id_1 and user_id_1_status_seq_1 are prefixes of
+# user_id_1_status_seq_1_status_id_1.
+OBSOLETE_INDEXES = {'StatusUpdates': ['status_text_1', 'user_id_1',
+                                      'user_id_1_status_seq_1']}
+
+# Collections already checked by this process
+_ENSURED = set()
+_ENSURED_LOCK = threading.Lock()
+
+
+def index_matches(existing, model):
+    '''
+    Checks if an index from index_information() matches an IndexModel
+    '''
+    wanted = model.document
+    if existing is not None and TEXT in wanted['key'].values():
+        # Text indexes are stored as _fts/_ftsx keys plus field weights
+        fields = {field for field, kind in wanted['key'].items() if kind == TEXT}
+        return set(existing.get('weights', {})) == fields
+    return (existing is not None
+            and list(existing['key']) == list(wanted['key'].items())
+            and existing.get('unique', False) == wanted.get('unique', False))
+
+
+def ensure_indexes(database, indexes):
+    '''
+    Creates the declared indexes of a pymongo collection if needed
+
+    The first call per collection in a process reads the existing indexes,
+    drops obsolete ones and creates the missing ones in one create_indexes
+    call. Later calls return without contacting the server. Returns the
+    names of the indexes created.
+    '''
+    key = (id(database.database.client), database.full_name)
+    with _ENSURED_LOCK:
+        if key in _ENSURED:
+            return []
+        existing = database.index_information()
+        for name in OBSOLETE_INDEXES.get(database.name, []):
+            if name in existing:
+                database.drop_index(name)
+                logging.info('Dropped obsolete index %s on %s.', name, database.full_name)
+        missing = [model for model in indexes
+                   if not index_matches(existing.get(model.document['name']), model)]
+        created = database.create_indexes(missing) if missing else []
+        if created:
+            logging.info('Created indexes %s on %s.', ', '.join(created), database.full_name)
+        _ENSURED.add(key)
+    return created
+
+
+def index_report(database, indexes):
+    '''
+    Reports on the indexes of a pymongo collection using $indexStats
+
+    Returns one dict per index with its name, key, number of operations
+    since the server started tracking it, and a list of issues: 'unused',
+    'undeclared' and 'redundant' (a prefix of another index's key).
+    '''
+    declared = {model.document['name'] for model in indexes}
+    stats = list(database.aggregate([{'$indexStats': {}}]))
+    keys = {stat['name']: list(stat['key'].items()) for stat in stats}
+    report = []
+    for stat in stats:
+        name = stat['name']
+        issues = []
+        if name != '_id_':
+            if stat['accesses']['ops'] == 0:
+                issues.append('unused')
+            if name not in declared:
+                issues.append('undeclared')
+            unique = stat.get('spec', {}).get('unique', False)
+            if not unique and any(other != name
+                                  and len(keys[other]) > len(keys[name])
+                                  and keys[other][:len(keys[name])] == keys[name]
+                                  for other in keys):
+                issues.append('redundant')
+        report.append({'name': name,
+                       'key': dict(stat['key']),
+                       'ops': stat['accesses']['ops'],
+                       'issues': issues})
+    return report
@@ -0,0 +1,173 @@
+'''
+Latency instrumentation for the social network project
+
+Collection methods are wrapped with timed() and every MongoDB command is
+timed by CommandLatencyListener, which socialnetwork_db registers on each
+client. Latencies go into fixed-size, log-bucketed histograms so recording
+costs a bisect and a few additions. snapshot() returns counts, errors and
+estimated percentiles for every operation.
+'''
+import bisect
+import functools
+import threading
+import time
+from pymongo import monitoring
+
+# Histogram bucket upper bounds in seconds: 1us doubling up to ~67s
+BUCKET_BOUNDS = tuple(2 ** i / 1e6 for i in range(27))
+
+
+class LatencyHistogram:
+    '''
+    Log-bucketed latency histogram
+
+    Percentiles are estimated as the upper bound of the bucket they fall
+    in, so they are accurate to within a factor of two.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        '''
+        Removes every recorded latency
+        '''
+        with self.lock:
+            self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+            self.count = 0
+            self.errors = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def record(self, seconds, error=False):
+        '''
+        Adds one latency, in seconds
+        '''
+        bucket = bisect.bisect_left(BUCKET_BOUNDS, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.errors += error
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        '''
+        Estimated latency in seconds below which fraction of calls fall
+        '''
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else self.max
+        return 0.0
+
+    def snapshot(self):
+        '''
+        Returns the count, errors, mean, max and p50/p95/p99 in ms
+        '''
+        with self.lock:
+            if not self.count:
+                return {'count': 0, 'errors': self.errors}
+            return {'count': self.count,
+                    'errors': self.errors,
+                    'mean_ms': self.total / self.count * 1000,
+                    'max_ms': self.max * 1000,
+                    'p50_ms': min(self.percentile(0.50), self.max) * 1000,
+                    'p95_ms': min(self.percentile(0.95), self.max) * 1000,
+                    'p99_ms': min(self.percentile(0.99), self.max) * 1000}
+
+
+class Metrics:
+    '''
+    Named latency histograms
+    '''
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        '''
+        Returns the histogram for name, creating it if needed
+        '''
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def snapshot(self):
+        '''
+        Returns {name: histogram snapshot} for every operation
+        '''
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        return {name: histogram.snapshot() for name, histogram in histograms}
+
+    def reset(self):
+        '''
+        Clears every histogram
+
+        The histograms are cleared in place because timed() keeps the
+        histogram of its operation.
+        '''
+        with self.lock:
+            histograms = list(self.histograms.values())
+        for histogram in histograms:
+            histogram.clear()
+
+
+METRICS = Metrics()
+
+
+def timed(name):
+    '''
+    Decorator recording the latency of every call under name
+
+    Calls which raise are recorded as errors.
+    '''
+    def decorate(func):
+        histogram = METRICS.histogram(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                histogram.record(time.perf_counter() - start, error=True)
+                raise
+            histogram.record(time.perf_counter() - start)
+            return result
+        return wrapper
+    return decorate
+
+
+class CommandLatencyListener(monitoring.CommandListener):
+    '''
+    Records the server round-trip latency of every MongoDB command
+    '''
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        METRICS.histogram('mongo.' + event.command_name).record(
+            event.duration_micros / 1e6)
+
+    def failed(self, event):
+        METRICS.histogram('mongo.' + event.command_name).record(
+            event.duration_micros / 1e6, error=True)
+
+
+COMMAND_LISTENER = CommandLatencyListener()
+
+
+def snapshot():
+    '''
+    Returns the latency snapshot of every operation and command
+    '''
+    return METRICS.snapshot()
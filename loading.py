@@ -0,0 +1,341 @@
+'''
+CSV loading for the social network collections
+
+Every loader reads rows through batch_rows, which validates them as they
+are read and yields fixed-size batches for insert_batch, so memory use
+does not grow with the size of the file. load_collection loads in one
+pass, load_collection_resumable checkpoints after every batch, and
+load_collection_parallel splits the file between worker processes.
+'''
+import csv
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pymongo
+import checkpoints
+import socialnetwork_db
+
+# Number of rows flushed to the database per insert_many call
+BATCH_SIZE = 5000
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+
+class LoadReport:
+    '''
+    Result of a CSV load
+
+    duplicates and errors hold (line number, message) tuples for rows which
+    were skipped because of a duplicate key or any other error.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.inserted = 0
+        self.duplicates = []
+        self.errors = []
+
+    @property
+    def success(self):
+        '''
+        True if no rows failed for reasons other than duplicate keys
+        '''
+        return not self.errors
+
+    def log(self, how=''):
+        '''
+        Logs the totals of the load
+        '''
+        logging.info('Loaded %s%s: %i inserted, %i duplicates, %i errors.',
+                     self.filename,
+                     how,
+                     self.inserted,
+                     len(self.duplicates),
+                     len(self.errors))
+
+
+def load_collection(filename, validator, collection, batch_size=BATCH_SIZE,
+                    ordered=True, references=None, on_insert=None):
+    # pylint: disable=R0913,R0917
+    '''
+    Method which loads status or user collection from CSV file
+
+    Rows are validated as they are read and flushed to the database in
+    batches of batch_size documents, so memory use does not grow with the
+    size of the file.
+
+    With ordered=True the load stops at the first invalid row or insert
+    error and True/False is returned. Batches flushed before the error stay
+    in the database.
+
+    With ordered=False every valid row is inserted with unordered bulk
+    writes, invalid rows and duplicate keys are recorded with their CSV line
+    numbers, and (True/False, LoadReport) is returned. Duplicate keys alone
+    do not make the load fail.
+
+    references maps a database key to a container of allowed values, such
+    as a UserIdIndex, and on_insert is called with each list of inserted
+    documents.
+    '''
+    report = LoadReport(filename)
+    try:
+        with open(filename, 'r', encoding="utf-8") as file:
+            reader = csv.DictReader(file)
+            with collection.mongo:
+                for batch, lines in batch_rows(reader, validator, batch_size, report,
+                                               references=references,
+                                               stop_on_invalid=ordered):
+                    if not insert_batch(batch, lines, collection.database, report,
+                                        ordered, on_insert) and ordered:
+                        return False
+    except FileNotFoundError:
+        report.errors.append((0, f'File {filename} not found'))
+    if ordered:
+        return report.success
+    report.log()
+    return report.success, report
+
+
+def batch_rows(reader, validator, batch_size, report, line_offset=0, references=None,
+               stop_on_invalid=False):
+    # pylint: disable=R0913,R0917
+    '''
+    Validates the rows of a csv reader and yields (documents, lines)
+    batches of at most batch_size valid rows
+
+    The line number of a row is line_offset + reader.line_num, so a reader
+    started part way into a file reports lines of the whole file. Invalid
+    rows are recorded in report.errors and skipped; with stop_on_invalid
+    the first one ends the rows without yielding the rows batched before
+    it.
+    '''
+    batch, lines = [], []
+    for row in reader:
+        line_num = line_offset + reader.line_num
+        new_row = validate_row(row, validator, line_num, report.filename, references)
+        if new_row is None:
+            report.errors.append((line_num, 'Invalid row'))
+            if stop_on_invalid:
+                return
+            continue
+        batch.append(new_row)
+        lines.append(line_num)
+        if len(batch) >= batch_size:
+            yield batch, lines
+            batch, lines = [], []
+    if batch:
+        yield batch, lines
+
+
+def validate_row(row, validator, line_num, filename, references=None):
+    '''
+    Validates a single CSV row and returns it with database keys
+
+    validator is the validation.RecordValidator for the row type. Returns
+    None if any value in the row is empty or invalid, or if a value is missing
+    from its container in references.
+    '''
+    new_row, failure = validator(row)
+    if failure is not None:
+        column, reason = failure
+        if reason == 'empty value':
+            print(f'Empty value found for {column} on ' \
+                  f'line {line_num} of {filename}.')
+        else:
+            logging.error('Invalid row on line %i of %s: %s %s.',
+                          line_num, filename, reason, column or '')
+        return None
+    for key, allowed in (references or {}).items():
+        if new_row.get(key) not in allowed:
+            logging.error('%s %s on line %i of %s does not exist.',
+                          key, new_row.get(key), line_num, filename)
+            return None
+    return new_row
+
+
+def insert_batch(batch, lines, database, report, ordered=True, on_insert=None):
+    # pylint: disable=R0913,R0917
+    '''
+    Inserts one batch of validated rows into a pymongo collection
+
+    lines holds the CSV line number of each row in batch and is used to
+    record failed rows in report. on_insert, if given, is called with the
+    documents which are in the database afterwards. Returns False if any
+    row failed.
+    '''
+    try:
+        database.insert_many(batch, ordered=ordered)
+        report.inserted += len(batch)
+        if on_insert is not None:
+            on_insert(batch)
+        logging.info("Inserting %i documents from %s into %s.",
+                     len(batch),
+                     report.filename,
+                     database.full_name)
+    except pymongo.errors.BulkWriteError as exc:
+        report.inserted += exc.details['nInserted']
+        failed = set()
+        for error in exc.details['writeErrors']:
+            entry = (lines[error['index']], error['errmsg'])
+            if error['code'] == DUPLICATE_KEY_ERROR:
+                report.duplicates.append(entry)
+            else:
+                report.errors.append(entry)
+                failed.add(error['index'])
+        if on_insert is not None:
+            # Ordered inserts stop at the first error
+            end = exc.details['writeErrors'][0]['index'] if ordered else len(batch)
+            on_insert([doc for i, doc in enumerate(batch[:end]) if i not in failed])
+        if ordered:
+            logging.error('pymongo BulkWriteError encountered.')
+            logging.error(exc.details['writeErrors'][0]['errmsg'])
+        return False
+    return True
+
+
+def load_collection_resumable(filename, validator, collection, batch_size=BATCH_SIZE,
+                              references=None, on_insert=None):
+    # pylint: disable=R0913,R0917
+    '''
+    Loads a CSV file with a durable checkpoint after every batch
+
+    The checkpoint, filename + checkpoints.CHECKPOINT_SUFFIX, records the
+    identity of the file and the byte offset and line after the last
+    inserted batch. A rerun on the same, unchanged file starts from there.
+    Rows are inserted with unordered bulk writes, so rows of a batch that
+    was interrupted before its checkpoint are reported as duplicates
+    instead of failing the load. Invalid rows are reported and skipped. The
+    checkpoint is removed once the whole file is loaded. Returns
+    (True/False, LoadReport).
+    '''
+    report = LoadReport(filename)
+    checkpoint_file = filename + checkpoints.CHECKPOINT_SUFFIX
+    try:
+        with open(filename, 'rb') as file:
+            identity = checkpoints.file_identity(filename, file)
+            fieldnames = next(csv.reader([file.readline().decode('utf-8-sig')]))
+            state = checkpoints.read_checkpoint(checkpoint_file, identity)
+            if state is None:
+                state = dict(identity, offset=file.tell(), line=1, batches=0)
+            else:
+                logging.info('Resuming %s from line %i after %i batches.',
+                             filename, state['line'], state['batches'])
+            file.seek(state['offset'])
+            reader = csv.DictReader(read_range(file, identity['size']),
+                                    fieldnames=fieldnames)
+            with collection.mongo:
+                # reader.line_num restarts at 1 after the checkpointed line
+                for batch, lines in batch_rows(reader, validator, batch_size, report,
+                                               state['line'], references):
+                    insert_batch(batch, lines, collection.database, report, False,
+                                 on_insert)
+                    checkpoints.write_checkpoint(checkpoint_file, state, file.tell(),
+                                                 lines[-1])
+    except FileNotFoundError:
+        report.errors.append((0, f'File {filename} not found'))
+        return False, report
+    checkpoints.remove_checkpoint(checkpoint_file)
+    report.log()
+    return report.success, report
+
+
+def load_collection_parallel(filename, validator, collection, processes,
+                             batch_size=BATCH_SIZE, references=None):
+    # pylint: disable=R0913,R0914,R0917
+    '''
+    Loads a CSV file with several worker processes
+
+    The file is split into byte ranges on line boundaries and each worker
+    parses, validates and inserts its own range through its own client with
+    unordered bulk writes. Rows must not contain quoted line breaks.
+    Returns (True/False, LoadReport) with the worker reports merged and
+    line numbers relative to the whole file. references is passed to
+    validate_row in each worker.
+    '''
+    report = LoadReport(filename)
+    try:
+        ranges, fieldnames = split_csv(filename, processes)
+    except FileNotFoundError:
+        report.errors.append((0, f'File {filename} not found'))
+        return False, report
+    target = (collection.mongo.host,
+              collection.mongo.port,
+              collection.mongo.options,
+              collection.database.database.name,
+              collection.name)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        spec = (fieldnames, validator, references, batch_size)
+        futures = [pool.submit(load_range, filename, start, end, spec, target)
+                   for start, end in ranges]
+        # Header is line 1; each range continues where the previous stopped
+        line_offset = 1
+        for future in futures:
+            part, line_count = future.result()
+            report.inserted += part.inserted
+            report.duplicates.extend((line + line_offset, msg)
+                                     for line, msg in part.duplicates)
+            report.errors.extend((line + line_offset, msg)
+                                 for line, msg in part.errors)
+            line_offset += line_count
+    report.log(f' with {processes} processes')
+    return report.success, report
+
+
+def split_csv(filename, parts):
+    '''
+    Splits the body of a CSV file into byte ranges which start on a line
+
+    Returns ([(start, end), ...], fieldnames).
+    '''
+    with open(filename, 'rb') as file:
+        fieldnames = next(csv.reader([file.readline().decode('utf-8-sig')]))
+        body_start = file.tell()
+        size = os.fstat(file.fileno()).st_size
+        step = max((size - body_start) // parts, 1)
+        bounds = [body_start]
+        for i in range(1, parts):
+            file.seek(max(body_start + i * step, bounds[-1]))
+            if file.tell() > body_start:
+                file.readline()
+            bounds.append(min(file.tell(), size))
+        bounds.append(size)
+    ranges = [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+    return ranges, fieldnames
+
+
+def read_range(file, end):
+    '''
+    Yields decoded lines from file until the byte offset end is reached
+    '''
+    while file.tell() < end:
+        line = file.readline()
+        if not line:
+            break
+        yield line.decode('utf-8')
+
+
+def load_range(filename, start, end, spec, target):
+    # pylint: disable=R0914
+    '''
+    Worker for load_collection_parallel
+
+    Parses, validates and inserts the rows between the byte offsets start
+    and end. spec is (fieldnames, validator, references, batch_size) and target
+    is (host, port, client options, database, collection). Returns
+    (LoadReport, number of lines read) with line numbers relative to start.
+    '''
+    fieldnames, validator, references, batch_size = spec
+    host, port, options, db_name, collection_name = target
+    report = LoadReport(filename)
+    # Workers are reused by the pool, so the shared client stays warm
+    client = socialnetwork_db.get_client(host, port, **options)
+    with open(filename, 'rb') as file:
+        database = client[db_name][collection_name]
+        file.seek(start)
+        reader = csv.DictReader(read_range(file, end), fieldnames=fieldnames)
+        for batch, lines in batch_rows(reader, validator, batch_size, report,
+                                       references=references):
+            insert_batch(batch, lines, database, report, ordered=False)
+    return report, reader.line_num
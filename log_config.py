@@ -0,0 +1,98 @@
+'''
+Logging setup for the social network project
+
+configure_logging sends log records through a queue to a background
+listener thread which does the file and console writes, so a logging
+call on a hot CRUD path only formats the message and enqueues it.
+Per-record success (INFO) messages, which users and user_status log
+through the RECORD_LOGGER logger, can also be sampled or rate-limited;
+warnings, errors and every other INFO message, such as load and sync
+summaries, are always kept.
+'''
+# pylint: disable=R0903
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+FILE_FORMAT = "%(asctime)s %(filename)s:%(lineno)-4d %(levelname)s %(message)s"
+# Logger for messages about single records, the only ones InfoSampler drops
+RECORD_LOGGER = 'socialnetwork.records'
+
+
+class InfoSampler(logging.Filter):
+    '''
+    Keeps one in every 1/sample_rate INFO records of RECORD_LOGGER, and at
+    most max_per_second of them per second
+
+    Records above INFO and records of other loggers always pass.
+    '''
+
+    def __init__(self, sample_rate=1.0, max_per_second=None, clock=time.monotonic):
+        super().__init__(RECORD_LOGGER)
+        self.every = max(round(1 / sample_rate), 1) if sample_rate > 0 else 0
+        self.max_per_second = max_per_second
+        self.clock = clock
+        self.seen = 0
+        self.window = None
+        self.in_window = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not super().filter(record):
+            return True
+        with self.lock:
+            self.seen += 1
+            if not self.every or self.seen % self.every:
+                return False
+            if self.max_per_second is not None:
+                window = int(self.clock())
+                if window != self.window:
+                    self.window, self.in_window = window, 0
+                if self.in_window >= self.max_per_second:
+                    return False
+                self.in_window += 1
+        return True
+
+
+def configure_logging(log_file, level=logging.INFO, queued=True, sample_rate=1.0,
+                      max_per_second=None, console=True):
+    '''
+    Configures the root logger to write to log_file and the console
+
+    With queued=True, records are written by a QueueListener thread which
+    is stopped, flushing the queue, at exit. sample_rate and
+    max_per_second limit per-record INFO messages as described in
+    InfoSampler.
+    Returns the QueueListener, or None when not queued.
+    '''
+    # pylint: disable=R0913,R0917
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setLevel(level)
+    file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handlers.append(console_handler)
+    if queued:
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, *handlers,
+                                                  respect_handler_level=True)
+        front = [logging.handlers.QueueHandler(records)]
+    else:
+        listener = None
+        front = handlers
+    if sample_rate < 1.0 or max_per_second is not None:
+        for handler in front:
+            handler.addFilter(InfoSampler(sample_rate, max_per_second))
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    for handler in front:
+        logger.addHandler(handler)
+    if listener is not None:
+        listener.start()
+        atexit.register(listener.stop)
+    return listener
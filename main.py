@@ -1,29 +1,59 @@
 '''
 main driver for a simple social network project
 '''
+# pylint: disable=R0903
 import csv
 import re
 import logging
-import pymongo
+from concurrent.futures import Future
+import cache
+import exports
+import indexes
+import instrumentation
+import loading
+import reports
+import socialnetwork_db
 import users
+import validation
 import user_status
 
+# Defaults of the loads and exports
+BATCH_SIZE = loading.BATCH_SIZE
+EXPORT_BATCH_SIZE = exports.EXPORT_BATCH_SIZE
+# (CSV column, database key) in the column order load_users and
+# load_status_updates read
+USER_COLUMNS = (('USER_ID', 'user_id'), ('NAME', 'user_name'),
+                ('LASTNAME', 'user_last_name'), ('EMAIL', 'user_email'))
+STATUS_COLUMNS = (('STATUS_ID', 'status_id'), ('USER_ID', 'user_id'),
+                  ('STATUS_TEXT', 'status_text'))
 
-def init_user_collection(mongo):
+
+def init_user_collection(mongo, cache_size=0, cache_ttl=60.0):
     '''
     Creates and returns a new instance of UserCollection
+
+    A positive cache_size puts an LRU cache with a TTL of cache_ttl
+    seconds in front of search_user.
     '''
-    return users.UserCollection(mongo)
+    user_cache = cache.LRUCache(cache_size, cache_ttl) if cache_size > 0 else None
+    return users.UserCollection(mongo, user_cache)
 
 
-def init_status_collection(mongo):
+def init_status_collection(mongo, cache_size=0, cache_ttl=60.0):
     '''
     Creates and returns a new instance of UserStatusCollection
+
+    A positive cache_size puts an LRU cache with a TTL of cache_ttl
+    seconds in front of search_status.
     '''
-    return user_status.UserStatusCollection(mongo)
+    status_cache = cache.LRUCache(cache_size, cache_ttl) if cache_size > 0 else None
+    return user_status.UserStatusCollection(mongo, status_cache)
 
 
-def load_users(filename, user_collection):
+@instrumentation.timed('main.load_users')
+def load_users(filename, user_collection, batch_size=BATCH_SIZE, ordered=True,
+               processes=None, resume=False):
+    # pylint: disable=R0913,R0917
     '''
     Opens a CSV file with user data and
     adds it to an existing instance of
@@ -36,16 +66,35 @@ def load_users(filename, user_collection):
     - Returns False if there are any errors
     (such as empty fields in the source CSV file)
     - Otherwise, it returns True.
-    '''
-    # Loop through each row in csv file
-    keys = {'USER_ID':  {'validate': validate_user_id,  'key': 'user_id'},
-            'EMAIL':    {'validate': validate_email,    'key': 'user_email'},
-            'NAME':     {'validate': validate_name,     'key': 'user_name'},
-            'LASTNAME': {'validate': validate_name,     'key': 'user_last_name'}}
-    return load_collection(filename, keys, user_collection)
-
-
-def load_status_updates(filename, status_collection):
+    - With ordered=False, duplicates are skipped in a single
+    unordered pass and (True/False, LoadReport) is returned.
+    - With processes=N, the file is loaded by N worker processes
+    and (True/False, LoadReport) is returned.
+    - With resume=True, progress is checkpointed after every batch
+    and a rerun continues from the checkpoint; (True/False,
+    LoadReport) is returned.
+    - processes and resume always load unordered, as if
+    ordered=False, so ordered is ignored with either.
+    '''
+    validator = validation.USER_VALIDATOR
+    if resume:
+        return loading.load_collection_resumable(filename, validator, user_collection,
+                                                 batch_size,
+                                                 on_insert=user_collection.track_inserted)
+    if processes:
+        result = loading.load_collection_parallel(filename, validator, user_collection,
+                                                  processes, batch_size)
+        if user_collection.user_index is not None:
+            user_collection.build_user_index()
+        return result
+    return loading.load_collection(filename, validator, user_collection, batch_size,
+                                   ordered, on_insert=user_collection.track_inserted)
+
+
+@instrumentation.timed('main.load_status_updates')
+def load_status_updates(filename, status_collection, batch_size=BATCH_SIZE, ordered=True,
+                        processes=None, user_collection=None, resume=False):
+    # pylint: disable=R0913,R0917
     '''
     Opens a CSV file with status data and adds it to an existing
     instance of UserStatusCollection
@@ -56,13 +105,97 @@ def load_status_updates(filename, status_collection):
     - Returns False if there are any errors(such as empty fields in the
       source CSV file)
     - Otherwise, it returns True.
+    - With ordered=False, duplicates are skipped in a single unordered
+      pass and (True/False, LoadReport) is returned.
+    - With processes=N, the file is loaded by N worker processes and
+      (True/False, LoadReport) is returned.
+    - If user_collection is given, statuses whose user does not exist are
+      rejected using its in-memory user_id index.
+    - With resume=True, progress is checkpointed after every batch and a
+      rerun continues from the checkpoint; (True/False, LoadReport) is
+      returned.
+    - processes and resume always load unordered, as if ordered=False,
+      so ordered is ignored with either.
 
     Author: Marcus Bakke
     '''
-    keys = {'STATUS_ID':   {'validate': validate_status_id,   'key': 'status_id'},
-            'USER_ID':     {'validate': validate_user_id,     'key': 'user_id'},
-            'STATUS_TEXT': {'validate': validate_status_text, 'key': 'status_text'}}
-    return load_collection(filename, keys, status_collection)
+    validator = validation.STATUS_VALIDATOR
+    references = None
+    if user_collection is not None:
+        if user_collection.user_index is None:
+            user_collection.build_user_index()
+        references = {'user_id': user_collection.user_index}
+    if resume:
+        return loading.load_collection_resumable(filename, validator, status_collection,
+                                                 batch_size, references=references)
+    if processes:
+        return loading.load_collection_parallel(filename, validator, status_collection,
+                                                processes, batch_size, references)
+    return loading.load_collection(filename, validator, status_collection, batch_size,
+                                   ordered, references=references)
+
+
+@instrumentation.timed('main.sync_users')
+def sync_users(filename, user_collection, batch_size=BATCH_SIZE, delete_missing=False,
+               status_collection=None):
+    # pylint: disable=R0913,R0917
+    '''
+    Brings user_collection in line with a full accounts CSV snapshot
+
+    Requirements:
+    - Only new users and users whose content_hash changed are written,
+      with batched upserts.
+    - If delete_missing is True, users which are not in the snapshot are
+      deleted. This is skipped when the snapshot has invalid rows, since
+      their users would otherwise be deleted. If status_collection is
+      given, the statuses of deleted users are deleted as well.
+    - Returns (True/False, counts) where counts holds the number of
+      users inserted, updated, unchanged and deleted, and of invalid rows.
+    '''
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'invalid': 0}
+    seen = set()
+    try:
+        with open(filename, 'r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.DictReader(file)
+            with user_collection.mongo:
+                sync_rows(reader, filename, user_collection, batch_size, counts, seen)
+    except FileNotFoundError:
+        logging.error('File %s not found.', filename)
+        return False, counts
+    if delete_missing and counts['invalid']:
+        logging.warning('Not deleting missing users: %s has %i invalid rows.',
+                        filename, counts['invalid'])
+    elif delete_missing:
+        missing = user_collection.missing_users(seen)
+        counts['deleted'] = sum(delete_users(missing, user_collection, status_collection))
+    logging.info('Synced %s: %s.', filename,
+                 ', '.join(f'{count} {name}' for name, count in counts.items()))
+    return not counts['invalid'], counts
+
+
+def sync_rows(reader, filename, user_collection, batch_size, counts, seen):
+    # pylint: disable=R0913,R0917
+    '''
+    Validates snapshot rows and syncs them in batches
+
+    Adds the user_id of every valid row to seen.
+    '''
+    report = loading.LoadReport(filename)
+    for batch, _ in loading.batch_rows(reader, validation.USER_VALIDATOR, batch_size,
+                                       report):
+        seen.update(user['user_id'] for user in batch)
+        sync_batch(batch, user_collection, counts)
+    counts['invalid'] += len(report.errors)
+
+
+def sync_batch(batch, user_collection, counts):
+    '''
+    Syncs one batch of user documents and adds to the running counts
+    '''
+    inserted, updated, unchanged = user_collection.sync_users(batch)
+    counts['inserted'] += inserted
+    counts['updated'] += updated
+    counts['unchanged'] += unchanged
 
 
 def add_user(user_id, email, user_name, user_last_name, user_collection):
@@ -95,15 +228,53 @@ def update_user(user_id, email, user_name, user_last_name, user_collection):
     return user_collection.modify_user(user_id, email, user_name, user_last_name)
 
 
-def delete_user(user_id, user_collection):
+def delete_user(user_id, user_collection, status_collection=None, transaction=False):
     '''
     Deletes a user from user_collection.
 
     Requirements:
     - Returns False if there are any errors (such as user_id not found)
     - Otherwise, it returns True.
+    - If status_collection is given, all statuses of the user are deleted
+      as in delete_user_cascade.
     '''
-    return user_collection.delete_user(user_id)
+    if status_collection is None:
+        return user_collection.delete_user(user_id)
+    return delete_user_cascade(user_id, user_collection, status_collection,
+                               transaction)[0]
+
+
+def delete_user_cascade(user_id, user_collection, status_collection, transaction=False):
+    '''
+    Deletes a user and all of their statuses
+
+    Requirements:
+    - The statuses are deleted with one delete_many.
+    - With transaction=True, and a server which supports transactions,
+      the user and the statuses are deleted in one transaction. It is off
+      by default because a user with very many statuses can exceed the
+      transaction lifetime limit.
+    - The user index and caches are only updated once the deletes are
+      committed.
+    - Returns (True, number of statuses deleted), or (False, 0) if the
+      user was not found.
+    '''
+    def cascade(session=None):
+        if not user_collection.delete_user(user_id, session=session):
+            return False, 0
+        count = status_collection.delete_user_statuses(user_id, session=session)
+        logging.info('Deleted user %s and %i statuses.', user_id, count)
+        return True, count
+
+    client = user_collection.mongo.connection
+    if not transaction or not socialnetwork_db.supports_transactions(client):
+        return cascade()
+    with client.start_session() as session:
+        deleted, count = session.with_transaction(cascade)
+    if deleted:
+        user_collection.forget_user(user_id)
+        status_collection.forget_user_statuses(user_id)
+    return deleted, count
 
 
 def search_user(user_id, user_collection):
@@ -112,13 +283,14 @@ def search_user(user_id, user_collection):
     UserCollection).
 
     Requirements:
-    - If the user is found, returns the corresponding User instance.
+    - If the user is found, returns the corresponding records.User.
     - Otherwise, it returns None.
     '''
     return user_collection.search_user(user_id)
 
 
-def add_status(user_id, status_id, status_text, status_collection):
+def add_status(user_id, status_id, status_text, status_collection,
+               user_collection=None):
     '''
     Creates a new instance of UserStatus and stores it in
     user_collection(which is an instance of UserStatusCollection)
@@ -127,14 +299,66 @@ def add_status(user_id, status_id, status_text, status_collection):
     - status_id cannot already exist in user_collection.
     - Returns False if there are any errors (for example, if
       user_collection.add_status() returns False).
+    - If user_collection is given, user_id must exist in it.
     - Otherwise, it returns True.
     '''
     # Validate inputs
     if not validate_status_inputs(status_id, user_id, status_text):
         return False
+    if user_collection is not None and not user_collection.user_exists(user_id):
+        logging.error('Unable to add %s because user %s does not exist.',
+                      status_id,
+                      user_id)
+        return False
     return status_collection.add_status(status_id, user_id, status_text)
 
 
+def queue_user(user_id, email, user_name, user_last_name, user_collection):
+    '''
+    Adds a user like add_user, through the collection's write-behind buffer
+
+    Requirements:
+    - Returns a Future resolving to True once the user is stored, and to
+      False for an invalid or duplicate user.
+    - The user is batched with other queued users when
+      user_collection.start_write_behind() was called, else added at once.
+    '''
+    if not validate_user_inputs(user_id, email, user_name, user_last_name):
+        return completed(False)
+    return user_collection.queue_user(user_id, email, user_name, user_last_name)
+
+
+def queue_status(user_id, status_id, status_text, status_collection,
+                 user_collection=None):
+    '''
+    Adds a status like add_status, through the collection's write-behind
+    buffer
+
+    Requirements:
+    - Returns a Future resolving to True once the status is stored, and to
+      False for an invalid or duplicate status or an unknown user.
+    - The status is batched with other queued statuses when
+      status_collection.start_write_behind() was called, else added at once.
+    '''
+    if not validate_status_inputs(status_id, user_id, status_text):
+        return completed(False)
+    if user_collection is not None and not user_collection.user_exists(user_id):
+        logging.error('Unable to add %s because user %s does not exist.',
+                      status_id,
+                      user_id)
+        return completed(False)
+    return status_collection.queue_status(status_id, user_id, status_text)
+
+
+def completed(result):
+    '''
+    Returns a Future already resolved to result
+    '''
+    future = Future()
+    future.set_result(result)
+    return future
+
+
 def update_status(status_id, user_id, status_text, status_collection):
     '''
     Updates the values of an existing status_id
@@ -166,57 +390,257 @@ def search_status(status_id, status_collection):
 
     Requirements:
     - If the status is found, returns the corresponding
-    UserStatus instance.
+    records.Status.
     - Otherwise, it returns None.
     '''
     return status_collection.search_status(status_id)
 
-# New functions
 
+def operation_stats():
+    '''
+    Returns latency and count statistics for every collection method,
+    bulk load and MongoDB command since the program started
+    '''
+    return instrumentation.snapshot()
+
+
+def index_report(collection):
+    '''
+    Reports unused, undeclared and redundant indexes of a collection
 
-def load_collection(filename, keys, collection):
+    collection is a UserCollection or UserStatusCollection.
     '''
-    Method which loads status or user collection from CSV file
+    return indexes.index_report(collection.database, collection.indexes)
+
+
+def status_counts(status_collection, batch_size=1000):
     '''
-    # Loop through each row in csv file
-    try:
-        with open(filename, 'r', encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            data = []
-            for row in reader:
-                new_row = row.copy()
-                # Check for errors in current row
-                for key, value in row.items():
-                    if value.replace(' ', '') == '':
-                        print(f'Empty value found for {key} on ' \
-                              f'line {reader.line_num} of {filename}.')
-                        return False
-                    # Validate input
-                    try:
-                        if not keys[key]['validate'](value):
-                            return False
-                    except KeyError:
-                        return False
-                    # Replace keys
-                    new_row[keys[key]['key']] = new_row.pop(key)
-                # Append data
-                data.append(new_row)
-            # Add data to database
-            try:
-                with collection.mongo:
-                    collection.database.insert_many(data)
-                    logging.info("Inserting %i %s from %s into database at %s.",
-                                 len(data),
-                                 collection.name,
-                                 filename,
-                                 str(collection.mongo.host)+':'+str(collection.mongo.port))
-            except pymongo.errors.BulkWriteError as exc:
-                logging.error('pymongo BulkWriteError encountered.')
-                logging.error(exc.details['writeErrors'][0]['errmsg'])
-                return False
+    Streams the number of statuses of every user who has any
+
+    Requirements:
+    - Yields {'user_id', 'statuses'} dicts in user_id order, counted by
+      the server.
+    '''
+    return reports.status_counts(status_collection, batch_size)
+
+
+def top_posters(status_collection, user_collection, limit=10):
+    '''
+    Returns the users with the most statuses
+
+    Requirements:
+    - Returns a list of at most limit {'user_id', 'statuses', 'user_name',
+      'user_last_name'} dicts, most statuses first.
+    '''
+    return list(reports.top_posters(status_collection, user_collection, limit))
+
+
+def inactive_users(user_collection, status_collection, batch_size=1000):
+    '''
+    Streams the users who have never posted a status
+
+    Requirements:
+    - Yields a records.User for each user without statuses, in user_id
+      order.
+    '''
+    return reports.inactive_users(user_collection, status_collection, batch_size)
+
+
+def add_users(records, user_collection):
+    '''
+    Adds many users to user_collection in one round trip
+
+    records holds (user_id, email, user_name, user_last_name) tuples.
+
+    Requirements:
+    - Each record is validated like add_user.
+    - Returns a list with True for each added user and False for each
+      invalid or duplicate user.
+    '''
+    return apply_batch(records,
+                       lambda record: validate_user_inputs(*record),
+                       user_collection.add_users)
+
+
+def update_users(records, user_collection):
+    '''
+    Updates many existing users with one bulk write
+
+    records holds (user_id, email, user_name, user_last_name) tuples.
+
+    Requirements:
+    - Each record is validated like update_user.
+    - Returns a list with True for each updated user and False for each
+      invalid or missing user.
+    '''
+    return apply_batch(records,
+                       lambda record: validate_user_inputs(*record),
+                       user_collection.modify_users)
+
+
+def delete_users(user_ids, user_collection, status_collection=None):
+    '''
+    Deletes many users from user_collection
+
+    Requirements:
+    - Returns a list with True for each deleted user and False for each
+      user that was not found.
+    - If status_collection is given, all statuses of the deleted users are
+      deleted as well.
+    '''
+    user_ids = list(user_ids)
+    results = user_collection.delete_users(user_ids)
+    if status_collection is not None:
+        deleted = [user_id for user_id, result in zip(user_ids, results) if result]
+        status_collection.delete_users_statuses(deleted)
+    return results
+
+
+def search_users(user_ids, user_collection):
+    '''
+    Searches for many users in user_collection
+
+    Requirements:
+    - Returns a list with a records.User for each user found and None for
+      each user that was not found.
+    '''
+    return user_collection.search_users(list(user_ids))
+
+
+def add_statuses(records, status_collection, user_collection=None):
+    '''
+    Adds many statuses to status_collection in one round trip
+
+    records holds (status_id, user_id, status_text) tuples.
+
+    Requirements:
+    - Each record is validated like add_status.
+    - If user_collection is given, each user_id must exist in it.
+    - Returns a list with True for each added status and False for each
+      invalid or duplicate status.
+    '''
+    def validate(record):
+        if not validate_status_inputs(*record):
+            return False
+        if user_collection is not None and not user_collection.user_exists(record[1]):
+            logging.error('Unable to add %s because user %s does not exist.',
+                          record[0],
+                          record[1])
+            return False
         return True
-    except FileNotFoundError:
-        return False
+    return apply_batch(records, validate, status_collection.add_statuses)
+
+
+def update_statuses(records, status_collection):
+    '''
+    Updates many existing statuses with one bulk write
+
+    records holds (status_id, user_id, status_text) tuples.
+
+    Requirements:
+    - Each record is validated like update_status.
+    - Returns a list with True for each updated status and False for each
+      invalid or missing status.
+    '''
+    return apply_batch(records,
+                       lambda record: validate_status_inputs(*record),
+                       status_collection.modify_statuses)
+
+
+def delete_statuses(status_ids, status_collection):
+    '''
+    Deletes many statuses from status_collection
+
+    Requirements:
+    - Returns a list with True for each deleted status and False for each
+      status that was not found.
+    '''
+    return status_collection.delete_statuses(list(status_ids))
+
+
+def search_statuses(status_ids, status_collection):
+    '''
+    Searches for many statuses in status_collection
+
+    Requirements:
+    - Returns a list with a records.Status for each status found and None for
+      each status that was not found.
+    '''
+    return status_collection.search_statuses(list(status_ids))
+
+
+def search_status_text(query, status_collection, page_size=20, limit=0):
+    '''
+    Searches the text of all statuses in status_collection
+
+    Requirements:
+    - Returns a generator of pages (lists) of at most page_size statuses,
+      most relevant first.
+    - Each status holds status_id, user_id, status_text and score.
+    '''
+    return status_collection.search_text(query, page_size, limit)
+
+
+def list_user_statuses(user_id, status_collection, batch_size=100, projection=None):
+    '''
+    Lists the statuses of user_id, ordered by the number in status_id
+
+    Requirements:
+    - Returns a lazy generator; statuses are fetched batch_size at a time.
+    - projection lists the fields to return (by default status_id,
+      user_id and status_text).
+    '''
+    return status_collection.user_statuses(user_id, batch_size, projection)
+
+
+def export_users(filename, user_collection, fmt=None, compression=None,
+                 batch_size=EXPORT_BATCH_SIZE):
+    '''
+    Exports all users to a CSV or JSON Lines file
+
+    Requirements:
+    - fmt is 'csv' (in the column layout load_users reads) or 'jsonl'.
+    - compression is None, 'gzip' or 'zstd'.
+    - Both are taken from the file extension when not given, such as
+      users.csv.gz or users.jsonl.zst; other extensions return False.
+    - Returns False if there are any errors.
+    - Otherwise, it returns True.
+    '''
+    return exports.export_collection(filename, user_collection, USER_COLUMNS, fmt,
+                                     compression, batch_size)
+
+
+def export_statuses(filename, status_collection, fmt=None, compression=None,
+                    batch_size=EXPORT_BATCH_SIZE):
+    '''
+    Exports all statuses to a CSV or JSON Lines file
+
+    Requirements:
+    - fmt is 'csv' (in the column layout load_status_updates reads) or
+      'jsonl'.
+    - compression is None, 'gzip' or 'zstd'.
+    - Both are taken from the file extension when not given, such as
+      statuses.csv.gz or statuses.jsonl.zst; other extensions return False.
+    - Returns False if there are any errors.
+    - Otherwise, it returns True.
+    '''
+    return exports.export_collection(filename, status_collection, STATUS_COLUMNS, fmt,
+                                     compression, batch_size)
+
+# New functions
+
+
+def apply_batch(records, validate, operation):
+    '''
+    Runs operation on the records which pass validate
+
+    Returns one result per record, False for records which failed
+    validation, in the order of records.
+    '''
+    records = list(records)
+    valid = [validate(record) for record in records]
+    results = iter(operation([record for record, ok in zip(records, valid) if ok]))
+    return [ok and next(results) for ok in valid]
 
 
 def validate_user_id(user_id):
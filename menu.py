@@ -6,24 +6,16 @@ Marcus incorporated all changes to user_status.py code.
 '''
 # pylint: disable=W1203
 import sys
+import itertools
 import logging
 from datetime import datetime
 import main
+import log_config
 import socialnetwork_db as sn
 
-# Build logger
-logging.basicConfig()
-FILE_FORMAT = "%(asctime)s %(filename)s:%(lineno)-4d %(levelname)s %(message)s"
-formatter = logging.Formatter(FILE_FORMAT)
+# Number of results shown at a time
+PAGE_SIZE = 20
 LOG_FILE = f'log_{datetime.today():%d-%m-%Y}.log'
-file_handler = logging .FileHandler(LOG_FILE)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-# Add launch statement
-logger.info(f'Session launched at {datetime.today():%H:%M:%S}.')
 
 
 def load_users():
@@ -39,7 +31,8 @@ def load_status_updates():
     Loads status updates from a file
     '''
     filename = input('Enter filename for status file: ')
-    main.load_status_updates(filename, status_collection)
+    main.load_status_updates(filename, status_collection,
+                             user_collection=user_collection)
 
 
 def add_user():
@@ -91,7 +84,11 @@ def delete_user():
     Deletes user from the database
     '''
     user_id = input('User ID: ')
-    main.delete_user(user_id, user_collection)
+    deleted, count = main.delete_user_cascade(user_id, user_collection, status_collection)
+    if deleted:
+        print(f"User and {count} statuses were successfully deleted")
+    else:
+        print("An error occurred while trying to delete user")
 
 
 def add_status():
@@ -101,12 +98,8 @@ def add_status():
     user_id = input('User ID: ')
     status_id = input('Status ID: ')
     status_text = input('Status text: ')
-    if user_collection.database.find_one(dict(user_id=user_id)):
-        main.add_status(user_id, status_id, status_text, status_collection)
-    else:
-        logging.error('Unable to add %s because user %s does not exist.',
-                      status_id,
-                      user_id)
+    main.add_status(user_id, status_id, status_text, status_collection,
+                    user_collection)
 
 
 def update_status():
@@ -139,18 +132,130 @@ def delete_status():
     main.delete_status(status_id, status_collection)
 
 
+def search_status_text():
+    '''
+    Searches the text of all statuses, one page at a time
+    '''
+    query = input('Enter text to search for: ')
+    for page in main.search_status_text(query, status_collection):
+        for result in page:
+            logging.info("%s (%s): %s",
+                         result['status_id'],
+                         result['user_id'],
+                         result['status_text'])
+        if input('Show more results? (Y/N): ').upper().strip() != 'Y':
+            break
+
+
+def list_user_statuses():
+    '''
+    Lists the statuses of a user, one page at a time
+    '''
+    user_id = input('User ID: ')
+    statuses = main.list_user_statuses(user_id, status_collection, PAGE_SIZE)
+    while True:
+        page = list(itertools.islice(statuses, PAGE_SIZE))
+        for result in page:
+            logging.info("%s: %s", result['status_id'], result['status_text'])
+        if len(page) < PAGE_SIZE or \
+                input('Show more statuses? (Y/N): ').upper().strip() != 'Y':
+            break
+
+
+def show_stats():
+    '''
+    Shows latency statistics for every operation so far
+    '''
+    for name, stats in main.operation_stats().items():
+        if stats['count']:
+            logging.info('%s: %i calls, %i errors, p50 %.2f ms, p99 %.2f ms',
+                         name,
+                         stats['count'],
+                         stats['errors'],
+                         stats['p50_ms'],
+                         stats['p99_ms'])
+
+
+def export_users():
+    '''
+    Exports all users to a file
+    '''
+    filename = input('Enter filename for user export (.csv, .jsonl, .gz, .zst): ')
+    if main.export_users(filename, user_collection):
+        print("Users were successfully exported")
+    else:
+        print("An error occurred while trying to export users")
+
+
+def export_statuses():
+    '''
+    Exports all statuses to a file
+    '''
+    filename = input('Enter filename for status export (.csv, .jsonl, .gz, .zst): ')
+    if main.export_statuses(filename, status_collection):
+        print("Statuses were successfully exported")
+    else:
+        print("An error occurred while trying to export statuses")
+
+
+def show_top_posters():
+    '''
+    Shows the users with the most statuses
+    '''
+    for result in main.top_posters(status_collection, user_collection, PAGE_SIZE):
+        logging.info('%s (%s %s): %i statuses',
+                     result['user_id'],
+                     result['user_name'],
+                     result['user_last_name'],
+                     result['statuses'])
+
+
+def list_inactive_users():
+    '''
+    Lists the users who never posted, one page at a time
+    '''
+    users = main.inactive_users(user_collection, status_collection, PAGE_SIZE)
+    while True:
+        page = list(itertools.islice(users, PAGE_SIZE))
+        for user in page:
+            logging.info('%s: %s %s', user.user_id, user.user_name, user.user_last_name)
+        if len(page) < PAGE_SIZE or \
+                input('Show more users? (Y/N): ').upper().strip() != 'Y':
+            break
+
+
+def show_status_counts():
+    '''
+    Shows the number of statuses of each user, one page at a time
+    '''
+    counts = main.status_counts(status_collection, PAGE_SIZE)
+    while True:
+        page = list(itertools.islice(counts, PAGE_SIZE))
+        for result in page:
+            logging.info('%s: %i statuses', result['user_id'], result['statuses'])
+        if len(page) < PAGE_SIZE or \
+                input('Show more users? (Y/N): ').upper().strip() != 'Y':
+            break
+
+
 def quit_program():
     '''
     Quits program
     '''
     logging.info('Quitting program.')
+    sn.close_clients()
     sys.exit()
 
 
 if __name__ == '__main__':
+    # Build logger; records are written by a background thread
+    log_config.configure_logging(LOG_FILE)
+    # Add launch statement
+    logging.info(f'Session launched at {datetime.today():%H:%M:%S}.')
     with sn.MongoDBConnection() as mongo:
         user_collection = main.init_user_collection(mongo)
         status_collection = main.init_status_collection(mongo)
+        user_collection.build_user_index()
         menu_options = {
             'A': load_users,
             'B': load_status_updates,
@@ -162,7 +267,15 @@ if __name__ == '__main__':
             'H': update_status,
             'I': search_status,
             'J': delete_status,
-            'K': quit_program
+            'K': quit_program,
+            'L': search_status_text,
+            'M': list_user_statuses,
+            'N': show_stats,
+            'O': export_users,
+            'P': export_statuses,
+            'Q': show_top_posters,
+            'R': list_inactive_users,
+            'S': show_status_counts
         }
         while True:
             user_selection = input("""
@@ -177,6 +290,14 @@ if __name__ == '__main__':
                                 I: Search status
                                 J: Delete status
                                 K: Quit
+                                L: Search status text
+                                M: List user statuses
+                                N: Show stats
+                                O: Export users
+                                P: Export statuses
+                                Q: Show top posters
+                                R: List inactive users
+                                S: Show status counts
 
                                 Please enter your choice: """)
             user_selection = user_selection.upper().strip()
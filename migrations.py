@@ -0,0 +1,326 @@
+'''
+Versioned schema migrations for the social network collections
+
+The schema version of each collection is kept in the SchemaVersions
+collection. Version 1 documents have an ObjectId _id and a unique index on
+their natural key, user_id or status_id. Version 2 documents use the
+natural key as _id, keep the key field as well, and have no separate
+unique index for it, so every insert maintains one unique index less and
+lookups by key go through _id. Version 3 sets status_seq on statuses
+stored before it existed.
+
+UserCollection and UserStatusCollection read the version, once per
+process, and query by key_field(). New documents are always written with
+the natural _id, so they need no migration. migrate() rewrites the old
+documents in batches, each in a transaction, while the collections stay
+in use: queries on the key field find documents in either form. A
+standalone server has no transactions, so there the move needs
+offline=True and no other writers. Processes started before the
+migration keep querying the key field until they restart, so the now
+redundant unique index is kept until drop_natural_key_indexes() is run
+after those restarts.
+
+    python migrations.py --database media
+    python migrations.py --database media --drop-indexes
+'''
+# user_status imports this module for schema versions
+# pylint: disable=R0401
+import argparse
+import itertools
+import logging
+import threading
+import pymongo
+import socialnetwork_db
+import user_status
+
+SCHEMA_COLLECTION = 'SchemaVersions'
+CURRENT_VERSION = 3
+# Version from which documents use their natural key as _id
+NATURAL_KEY_VERSION = 2
+
+KEY_FIELDS = {'UserAccounts': 'user_id', 'StatusUpdates': 'status_id'}
+# Unique indexes made redundant by the natural _id
+NATURAL_KEY_INDEXES = {'UserAccounts': 'user_id_1', 'StatusUpdates': 'status_id_1'}
+
+# Documents moved per batch
+BATCH_SIZE = 1000
+
+# Schema versions already read by this process
+_VERSIONS = {}
+_VERSIONS_LOCK = threading.Lock()
+
+
+def schema_version(database, name, cached=True):
+    '''
+    Returns the schema version of collection name in a pymongo database
+
+    A collection without a recorded version is at version 1 if it holds
+    documents, and is recorded at CURRENT_VERSION if it is empty. The
+    version is read from the server once per process unless cached is
+    False.
+    '''
+    key = (id(database.client), database.name, name)
+    with _VERSIONS_LOCK:
+        if cached and key in _VERSIONS:
+            return _VERSIONS[key]
+    record = database[SCHEMA_COLLECTION].find_one({'_id': name})
+    if record is not None:
+        version = record['version']
+    elif database[name].find_one({}, {'_id': 1}) is not None:
+        version = 1
+    else:
+        version = CURRENT_VERSION
+        set_schema_version(database, name, version)
+    with _VERSIONS_LOCK:
+        _VERSIONS[key] = version
+    return version
+
+
+def set_schema_version(database, name, version):
+    '''
+    Records the schema version of collection name
+    '''
+    database[SCHEMA_COLLECTION].update_one({'_id': name}, {'$set': {'version': version}},
+                                           upsert=True)
+    with _VERSIONS_LOCK:
+        _VERSIONS[(id(database.client), database.name, name)] = version
+
+
+def key_field(name, version):
+    '''
+    Returns the field to query documents of collection name by key
+    '''
+    return '_id' if version >= NATURAL_KEY_VERSION else KEY_FIELDS[name]
+
+
+def declared_indexes(name, models, version):
+    '''
+    Returns the IndexModels of a collection still needed at version
+    '''
+    if version < NATURAL_KEY_VERSION:
+        return models
+    return [model for model in models
+            if model.document['name'] != NATURAL_KEY_INDEXES.get(name)]
+
+
+def old_documents(collection, limit, session=None):
+    '''
+    Returns up to limit documents which still have an ObjectId _id
+    '''
+    return list(collection.find({'_id': {'$type': 'objectId'}}, session=session)
+                .limit(limit))
+
+
+def move_documents(collection, documents, session=None):
+    '''
+    Replaces documents with copies keyed by their natural key
+
+    Copies whose key is already taken, by a document written since the
+    batch was read, are skipped.
+    '''
+    key = KEY_FIELDS[collection.name]
+    collection.delete_many({'_id': {'$in': [document['_id'] for document in documents]}},
+                           session=session)
+    copies = [dict(document, _id=document[key]) for document in documents]
+    try:
+        collection.insert_many(copies, ordered=False, session=session)
+    except pymongo.errors.BulkWriteError as exc:
+        if any(error['code'] != 11000 for error in exc.details['writeErrors']):
+            raise
+    return len(copies)
+
+
+def journal(collection):
+    '''
+    Returns the collection holding the batch being moved without a
+    transaction
+    '''
+    return collection.database[collection.name + '.migration']
+
+
+def replay_journal(collection):
+    '''
+    Finishes a batch interrupted between its delete and insert
+    '''
+    pending = list(journal(collection).find())
+    if pending:
+        logging.warning('Replaying %i journaled documents of %s.', len(pending),
+                        collection.full_name)
+        move_documents(collection, pending)
+        journal(collection).delete_many({})
+
+
+def migrate_batch(collection, batch_size, transactions):
+    '''
+    Moves one batch of old documents and returns how many were moved
+
+    With transactions the batch is read, deleted and reinserted in one
+    transaction. Without them, which migrate_natural_keys only allows
+    offline, the batch is first copied to a journal so a crash between the
+    delete and the insert loses nothing.
+    '''
+    def move(session):
+        documents = old_documents(collection, batch_size, session)
+        return move_documents(collection, documents, session) if documents else 0
+
+    if transactions:
+        with collection.database.client.start_session() as session:
+            return session.with_transaction(move)
+    documents = old_documents(collection, batch_size)
+    if not documents:
+        return 0
+    journal(collection).insert_many(documents)
+    moved = move_documents(collection, documents)
+    journal(collection).delete_many({})
+    return moved
+
+
+def migrate_natural_keys(collection, batch_size=BATCH_SIZE, offline=False):
+    '''
+    Migration to version 2: rewrites old documents to use the natural
+    key as _id
+
+    Raises RuntimeError if documents need moving, the server has no
+    transactions and offline is False: moving a batch outside a
+    transaction would undo writes made to it meanwhile.
+    '''
+    replay_journal(collection)
+    transactions = socialnetwork_db.supports_transactions(collection.database.client)
+    if not transactions and not offline and old_documents(collection, 1):
+        raise RuntimeError(f'{collection.full_name} can only be migrated online on a '
+                           'replica set; stop other writers and migrate with '
+                           'offline=True')
+    moved = 0
+    while True:
+        count = migrate_batch(collection, batch_size, transactions)
+        if not count:
+            break
+        moved += count
+        logging.info('Moved %i documents of %s to natural keys.', moved,
+                     collection.full_name)
+    return moved
+
+
+def has_natural_key_index(database, name):
+    '''
+    Checks if collection name still has the unique index on its key field
+    '''
+    return NATURAL_KEY_INDEXES[name] in database[name].index_information()
+
+
+def drop_natural_key_indexes(database, name):
+    '''
+    Drops the unique index replaced by the natural _id, if it exists
+
+    Run once every process started before the migration has restarted:
+    those still query the key field and would scan the collection without
+    the index. Returns True if the index was dropped.
+    '''
+    if schema_version(database, name, cached=False) < NATURAL_KEY_VERSION:
+        raise RuntimeError(f'{name} is not migrated to natural keys yet')
+    if not has_natural_key_index(database, name):
+        return False
+    database[name].drop_index(NATURAL_KEY_INDEXES[name])
+    logging.info('Dropped redundant index %s on %s.', NATURAL_KEY_INDEXES[name], name)
+    return True
+
+
+def backfill_status_seq(collection, batch_size=BATCH_SIZE, offline=False):
+    # pylint: disable=W0613
+    '''
+    Migration to version 3: sets status_seq, the numeric suffix of
+    status_id, on statuses stored without it
+
+    status_seq is computed by user_status.status_sequence, as for new
+    statuses, and not with $toInt, which rejects suffixes int() accepts
+    such as ' 12' or '1_000'. Statuses without a numeric suffix get None.
+    The updates are sent with one bulk_write per batch_size statuses;
+    collections other than StatusUpdates are left alone. Returns the number
+    of statuses updated.
+    '''
+    if collection.name != 'StatusUpdates':
+        return 0
+    documents = collection.find({'status_seq': {'$exists': False}}, {'status_id': 1},
+                                batch_size=batch_size)
+    updated = 0
+    while True:
+        batch = list(itertools.islice(documents, batch_size))
+        if not batch:
+            break
+        collection.bulk_write(
+            [pymongo.UpdateOne({'_id': document['_id']},
+                               {'$set': {'status_seq': user_status.status_sequence(
+                                   document.get('status_id', ''))}})
+             for document in batch], ordered=False)
+        updated += len(batch)
+        logging.info('Set status_seq on %i statuses.', updated)
+    return updated
+
+
+MIGRATIONS = {2: migrate_natural_keys, 3: backfill_status_seq}
+
+
+def migrate(database, name, batch_size=BATCH_SIZE, offline=False):
+    '''
+    Applies every pending migration to collection name in a pymongo
+    database and returns its new schema version
+
+    The version is recorded after each migration, so an interrupted run
+    continues where it stopped. offline allows moving documents on a
+    server without transactions; see migrate_natural_keys.
+    '''
+    version = schema_version(database, name, cached=False)
+    while version < CURRENT_VERSION:
+        version += 1
+        logging.info('Migrating %s to schema version %i.', name, version)
+        MIGRATIONS[version](database[name], batch_size, offline)
+        set_schema_version(database, name, version)
+    return version
+
+
+def migrate_all(database, batch_size=BATCH_SIZE, offline=False, drop_indexes=False):
+    '''
+    Migrates both collections, or drops their redundant indexes, and
+    returns a line of output for each
+    '''
+    lines = []
+    for name in KEY_FIELDS:
+        if drop_indexes:
+            dropped = drop_natural_key_indexes(database, name)
+            lines.append(f'{name}: dropped {NATURAL_KEY_INDEXES[name]}' if dropped
+                         else f'{name}: no redundant index')
+            continue
+        version = migrate(database, name, batch_size, offline)
+        lines.append(f'{name} at schema version {version}')
+        if has_natural_key_index(database, name):
+            lines.append(f'{name} keeps index {NATURAL_KEY_INDEXES[name]} for processes '
+                         'started before the migration, which still query by it; '
+                         'restart them, then run again with --drop-indexes')
+    return lines
+
+
+def main_cli(argv=None):
+    '''
+    Parses the command line and migrates both collections
+    '''
+    # pylint: disable=C0415
+    import cli
+    parser = argparse.ArgumentParser(description='Migrate the social network schema.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=27017)
+    parser.add_argument('--database', default='media')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    cli.add_migrate_arguments(parser)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=logging.BASIC_FORMAT)
+    with socialnetwork_db.MongoDBConnection(args.host, args.port,
+                                            database=args.database) as mongo:
+        database = mongo.connection[mongo.database]
+        for line in migrate_all(database, args.batch_size, args.offline,
+                                args.drop_indexes):
+            print(line)
+    socialnetwork_db.close_clients()
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,79 @@
+'''
+Compact record types returned by user and status searches
+
+User and Status are tuple-backed, so a record costs one small tuple
+instead of a dict with an ObjectId, and they are read with a projection
+of exactly their fields so the server never sends, and the driver never
+decodes, anything else. They also answer record['field'], record.get(),
+keys() and dict(record) like the documents returned before, so callers
+indexing by field name keep working.
+'''
+# Record is a mixin for namedtuple classes, which provide _fields and _make
+# pylint: disable=E1101
+import collections
+
+USER_FIELDS = ('user_id', 'user_email', 'user_name', 'user_last_name')
+STATUS_FIELDS = ('status_id', 'user_id', 'status_text')
+
+
+class Record:
+    '''
+    Mapping-style access for the namedtuple records below
+    '''
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self._fields:
+                raise KeyError(key)
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        '''
+        Returns the field named key, or default if there is none
+        '''
+        return getattr(self, key) if key in self._fields else default
+
+    def keys(self):
+        '''
+        Returns the field names
+        '''
+        return self._fields
+
+    @classmethod
+    def projection(cls):
+        '''
+        Returns the find() projection of the record fields
+        '''
+        return dict({'_id': 0}, **{field: 1 for field in cls._fields})
+
+    @classmethod
+    def from_document(cls, document):
+        '''
+        Builds a record from a projected document, or returns None
+        '''
+        if document is None:
+            return None
+        return cls._make(document.get(field) for field in cls._fields)
+
+
+class User(Record, collections.namedtuple('User', USER_FIELDS)):
+    '''
+    A user account
+    '''
+    __slots__ = ()
+
+    @property
+    def email(self):
+        '''
+        The user_email field, under the name used by add_user
+        '''
+        return self.user_email
+
+
+class Status(Record, collections.namedtuple('Status', STATUS_FIELDS)):
+    '''
+    A status message
+    '''
+    __slots__ = ()
@@ -0,0 +1,86 @@
+'''
+Server-side reports over the user and status collections
+
+Each report is one aggregation pipeline run with allowDiskUse, so large
+collections are grouped and joined by the server without memory limits,
+and each yields its results as the cursor returns them, batch_size at a
+time, instead of loading whole collections into Python. The pipelines
+start from the user_id indexes: status counts scan the
+user_id_1_status_seq_1_status_id_1 index in order, and the $lookup joins
+match on indexed key fields.
+'''
+from records import User
+
+
+def aggregate(collection, pipeline, batch_size):
+    '''
+    Runs pipeline on a UserCollection or UserStatusCollection and yields
+    the results
+    '''
+    cursor = collection.database.aggregate(pipeline, allowDiskUse=True,
+                                           batchSize=batch_size)
+    with cursor:
+        yield from cursor
+
+
+def status_counts(status_collection, batch_size=1000):
+    '''
+    Yields {'user_id', 'statuses'} for every user with statuses, in
+    user_id order
+    '''
+    pipeline = [{'$sort': {'user_id': 1}},
+                {'$group': {'_id': '$user_id', 'statuses': {'$sum': 1}}},
+                {'$sort': {'_id': 1}},
+                {'$project': {'_id': 0, 'user_id': '$_id', 'statuses': 1}}]
+    return aggregate(status_collection, pipeline, batch_size)
+
+
+def top_posters(status_collection, user_collection, limit=10):
+    '''
+    Yields the limit users with the most statuses, most first
+
+    Each result holds user_id, statuses and the user_name and
+    user_last_name of the user, which are None for statuses whose user no
+    longer exists.
+    '''
+    pipeline = [{'$sort': {'user_id': 1}},
+                {'$group': {'_id': '$user_id', 'statuses': {'$sum': 1}}},
+                {'$sort': {'statuses': -1, '_id': 1}},
+                {'$limit': limit},
+                {'$lookup': {'from': user_collection.name,
+                             'localField': '_id',
+                             'foreignField': user_collection.key,
+                             'as': 'user'}},
+                {'$project': {'_id': 0,
+                              'user_id': '$_id',
+                              'statuses': 1,
+                              'user_name': {'$arrayElemAt': ['$user.user_name', 0]},
+                              'user_last_name': {'$arrayElemAt': ['$user.user_last_name',
+                                                                  0]}}}]
+    for result in aggregate(status_collection, pipeline, limit):
+        result.setdefault('user_name', None)
+        result.setdefault('user_last_name', None)
+        yield result
+
+
+def inactive_users(user_collection, status_collection, batch_size=1000):
+    '''
+    Yields a records.User for every user without statuses, in user_id
+    order
+
+    The $lookup stops at the first status of each user, found through the
+    user_id_1_status_seq_1_status_id_1 index.
+    '''
+    pipeline = [{'$sort': {user_collection.key: 1}},
+                {'$project': User.projection()},
+                {'$lookup': {'from': status_collection.name,
+                             'let': {'user_id': '$user_id'},
+                             'pipeline': [{'$match': {'$expr': {'$eq': ['$user_id',
+                                                                        '$$user_id']}}},
+                                          {'$limit': 1},
+                                          {'$project': {'_id': 1}}],
+                             'as': 'statuses'}},
+                {'$match': {'statuses': {'$size': 0}}},
+                {'$project': {'statuses': 0}}]
+    for user in aggregate(user_collection, pipeline, batch_size):
+        yield User.from_document(user)
@@ -1,22 +1,116 @@
+'''
+MongoDB connection handling for the social network project
+
+MongoClient instances are shared through a process-wide registry, so
+repeated connections to the same server reuse one warm connection pool.
+The registry counts the MongoDBConnections using each client, and closing
+one only closes the client once no other uses it.
+'''
+import os
+import threading
 from pymongo import MongoClient
+import instrumentation
+
+# Shared clients keyed by process id, host, port and client options
+_CLIENTS = {}
+# Number of open MongoDBConnections using each client, by id of the client
+_USERS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(host='127.0.0.1', port=27017, **options):
+    '''
+    Returns the shared MongoClient for host, port and options
+
+    A new client is only created the first time a combination is requested
+    in the current process. Forked processes get their own clients. Every
+    client times its commands with instrumentation.COMMAND_LISTENER.
+    '''
+    with _CLIENTS_LOCK:
+        return _get_client(host, port, options)
+
+
+def _get_client(host, port, options):
+    '''
+    get_client for callers holding _CLIENTS_LOCK
+    '''
+    key = (os.getpid(), host, port, tuple(sorted(options.items())))
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = MongoClient(host, port,
+                             event_listeners=[instrumentation.COMMAND_LISTENER],
+                             **options)
+        _CLIENTS[key] = client
+    return client
+
+
+def close_clients():
+    '''
+    Closes every shared client created by this process
+    '''
+    with _CLIENTS_LOCK:
+        for (pid, *_), client in _CLIENTS.items():
+            if pid == os.getpid():
+                client.close()
+        _CLIENTS.clear()
+        _USERS.clear()
+
+
+def supports_transactions(client):
+    '''
+    Returns True if client is connected to a replica set or sharded cluster
+    '''
+    topology = client.topology_description.topology_type_name
+    if topology == 'Unknown':
+        hello = client.admin.command('hello')
+        return 'setName' in hello or hello.get('msg') == 'isdbgrid'
+    return topology in ('ReplicaSetWithPrimary', 'Sharded')
 
 
 class MongoDBConnection():
     '''MongoDB Connection'''
 
-    def __init__(self, host='127.0.0.1', port=27017):
+    # pylint: disable=R0913,R0917
+    def __init__(self, host='127.0.0.1', port=27017, database='media',
+                 max_pool_size=100, server_selection_timeout_ms=30000,
+                 **options):
         self.host = host
         self.port = port
+        self.database = database
+        self.options = {'maxPoolSize': max_pool_size,
+                        'serverSelectionTimeoutMS': server_selection_timeout_ms,
+                        **options}
         self.connection = None
 
     def __enter__(self):
-        self.connection = MongoClient(self.host, self.port)
+        if self.connection is None:
+            with _CLIENTS_LOCK:
+                self.connection = _get_client(self.host, self.port, self.options)
+                _USERS[id(self.connection)] = _USERS.get(id(self.connection), 0) + 1
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.close()
+        # The client is shared, so it stays open for the next caller
+        pass
+
+    def close(self):
+        '''
+        Stops using the shared client, and closes it if no other
+        MongoDBConnection uses it
+        '''
+        client, self.connection = self.connection, None
+        if client is None:
+            return
+        with _CLIENTS_LOCK:
+            users = _USERS.pop(id(client), 0) - 1
+            if users > 0:
+                _USERS[id(client)] = users
+                return
+            for key, shared in list(_CLIENTS.items()):
+                if shared is client:
+                    del _CLIENTS[key]
+        client.close()
 
 
 def print_mdb_collection(collection_name):
     [print(doc) for doc in collection_name.find()]
-        
\ No newline at end of file
@@ -2,14 +2,297 @@
 Unittest module.
 Disable "Too many public methods" pylint message.
 '''
-# pylint: disable=R0904
+# pylint: disable=R0904,R0903,C0302
 import unittest
+import asyncio
 import os
+import gzip
+import io
+import csv
+import contextlib
+import concurrent.futures
+import tempfile
+import types
 import logging
 from mock import patch
+import pymongo
 import users
 import user_status
+import user_index
+import cache
 import main
+import log_config
+import instrumentation
+import datagen
+from benchmarks import datasets
+from benchmarks import __main__ as bench
+import indexes
+import validation
+import async_main
+import write_buffer
+import cli
+import records
+import migrations
+import loading
+import checkpoints
+import exports
+import socialnetwork_db
+
+
+class FakeDatabase:
+    '''
+    Stands in for a pymongo collection in bulk insert tests
+
+    insert_many stores documents by _id and reports duplicates like the
+    server. With crash_at=n, the nth call stores its first document and
+    then raises RuntimeError, like a process killed mid-batch.
+    '''
+    full_name = 'test.fake'
+
+    def __init__(self, crash_at=None):
+        self.documents = {}
+        self.calls = []
+        self.crash_at = crash_at
+
+    def insert_many(self, documents, ordered=True):
+        '''
+        Inserts documents, raising BulkWriteError for duplicate _ids
+        '''
+        self.calls.append([document['_id'] for document in documents])
+        if len(self.calls) == self.crash_at:
+            self.documents[documents[0]['_id']] = documents[0]
+            raise RuntimeError('crashed')
+        inserted, errors = 0, []
+        for index, document in enumerate(documents):
+            if document['_id'] in self.documents:
+                errors.append({'index': index, 'code': 11000,
+                               'errmsg': f'E11000 duplicate key {document["_id"]}'})
+                if ordered:
+                    break
+            else:
+                self.documents[document['_id']] = document
+                inserted += 1
+        if errors:
+            raise pymongo.errors.BulkWriteError({'nInserted': inserted,
+                                                 'writeErrors': errors})
+
+
+class FakeCollection:
+    '''
+    Stands in for UserCollection or UserStatusCollection
+    '''
+
+    def __init__(self, database=None):
+        self.mongo = contextlib.nullcontext()
+        self.database = database or FakeDatabase()
+
+
+class FakeFindDatabase:
+    '''
+    Stands in for a pymongo collection in find() paging tests
+
+    Supports equality, $gt, $ne, $or and $text filters, sort and limit.
+    A $text search scores a document by the number of search words in its
+    status_text.
+    '''
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+        self.options = []
+
+    @staticmethod
+    def matches(document, query):
+        '''
+        Checks if document matches a filter
+        '''
+        for key, condition in query.items():
+            if key == '$or':
+                if not any(FakeFindDatabase.matches(document, part) for part in condition):
+                    return False
+                continue
+            value = document.get(key)
+            if not isinstance(condition, dict):
+                if value != condition:
+                    return False
+                continue
+            for operator, argument in condition.items():
+                if operator == '$gt' and (value is None or value <= argument):
+                    return False
+                if operator == '$ne' and value == argument:
+                    return False
+        return True
+
+    def find(self, query, fields, batch_size=0, limit=0):
+        '''
+        Returns a cursor over the matching documents with the given fields
+        '''
+        self.queries.append(query)
+        self.options.append({'batch_size': batch_size, 'limit': limit})
+        query = dict(query)
+        words = set(query.pop('$text', {}).get('$search', '').split())
+        found = []
+        for document in self.documents:
+            if words:
+                score = len(words & set(document.get('status_text', '').split()))
+                if not score:
+                    continue
+                document = dict(document, score=score)
+            if self.matches(document, query):
+                found.append({key: value for key, value in document.items()
+                              if fields.get(key)})
+        return FakeFindCursor(found, limit)
+
+
+class FakeFindCursor:
+    '''
+    Stands in for a pymongo Cursor
+    '''
+
+    def __init__(self, documents, limit=0):
+        self.documents = documents
+        self.count = limit
+
+    def __iter__(self):
+        return iter(self.documents[:self.count] if self.count else self.documents)
+
+    def sort(self, keys):
+        '''
+        Sorts ascending on keys, with missing values first, or descending
+        on a textScore key
+        '''
+        for key, direction in reversed(keys):
+            self.documents.sort(
+                key=lambda document, key=key: (document.get(key) is not None,
+                                               document.get(key) or 0),
+                reverse=direction == {'$meta': 'textScore'})
+        return self
+
+    def limit(self, count):
+        '''
+        Keeps the first count documents
+        '''
+        return iter(self.documents[:count])
+
+
+class FakeWriteDatabase:
+    '''
+    Stands in for a pymongo collection in single-document write tests
+
+    Filters match on equality; results carry raw_result['n'] and
+    deleted_count like pymongo's.
+    '''
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.sessions = []
+        self.updated = []
+
+    @staticmethod
+    def matches(document, query):
+        '''
+        Checks if document matches a filter of equalities and $in
+        '''
+        for key, value in query.items():
+            if isinstance(value, dict):
+                if document.get(key) not in value['$in']:
+                    return False
+            elif document.get(key) != value:
+                return False
+        return True
+
+    def matching(self, query):
+        '''
+        Returns the documents matching a filter
+        '''
+        return [document for document in self.documents if self.matches(document, query)]
+
+    def find(self, query, projection=None, batch_size=None):
+        '''
+        Returns copies of the matching documents with the projected fields
+        '''
+        # pylint: disable=W0613
+        return [{key: value for key, value in document.items()
+                 if projection is None or projection.get(key)}
+                for document in self.matching(query)]
+
+    def bulk_write(self, requests, ordered=True):
+        '''
+        Applies UpdateOne requests, with upserts
+        '''
+        # pylint: disable=W0212,W0613
+        for request in requests:
+            found = self.matching(request._filter)[:1]
+            if not found and request._upsert:
+                found = [dict(request._filter, **request._doc.get('$setOnInsert', {}))]
+                self.documents.append(found[0])
+            for document in found:
+                document.update(request._doc['$set'])
+            self.updated.append(request._filter)
+
+    def find_one(self, query, projection=None):
+        '''
+        Returns the first matching document
+        '''
+        # pylint: disable=W0613
+        found = self.matching(query)
+        return dict(found[0]) if found else None
+
+    def update_one(self, query, update):
+        '''
+        Applies $set to the first matching document
+        '''
+        found = self.matching(query)[:1]
+        for document in found:
+            document.update(update['$set'])
+        return types.SimpleNamespace(raw_result={'n': len(found)})
+
+    def delete_many(self, query, session=None, limit=None):
+        '''
+        Deletes the matching documents, or the first limit of them
+        '''
+        found = self.matching(query)[:limit]
+        self.sessions.append(session)
+        self.documents[:] = [doc for doc in self.documents
+                             if not any(doc is deleted for deleted in found)]
+        return types.SimpleNamespace(raw_result={'n': len(found)}, deleted_count=len(found))
+
+    def delete_one(self, query, session=None):
+        '''
+        Deletes the first matching document
+        '''
+        return self.delete_many(query, session, limit=1)
+
+
+def stub_collection(cls, documents, record_cache=None, index=None):
+    '''
+    Builds a UserCollection or UserStatusCollection over FakeWriteDatabase
+    without connecting to a server
+    '''
+    collection = cls.__new__(cls)
+    collection.database = FakeWriteDatabase(documents)
+    collection.key = 'user_id' if cls is users.UserCollection else 'status_id'
+    collection.cache = record_cache
+    collection.user_index = index
+    return collection
+
+
+def write_accounts(filename, rows):
+    '''
+    Writes an accounts CSV file with the given user rows
+    '''
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(datagen.USER_HEADER)
+        writer.writerows(rows)
+
+
+def account_rows(count):
+    '''
+    Returns count valid user rows; row i is on line i + 2 of the file
+    '''
+    return [[f'user{i}', 'Eve', 'Miles', f'user{i}@uw.edu'] for i in range(count)]
+
 
 class TestMain(unittest.TestCase):
     '''
@@ -431,6 +714,953 @@ class TestMain(unittest.TestCase):
         for text in [1234, 12314.0, {'dict': 'hello'}, (1, 2), [1, 2, 3]]:
             self.assertFalse(main.validate_status_text(text))
 
+    def test_bloom_filter(self):
+        '''
+        Test BloomFilter membership
+        '''
+        bloom = user_index.BloomFilter(1000, 0.01)
+        user_ids = [f'user{i}' for i in range(1000)]
+        for user_id in user_ids:
+            bloom.add(user_id)
+        # No false negatives
+        for user_id in user_ids:
+            self.assertIn(user_id, bloom)
+        # False positive rate close to the requested error rate
+        false_positives = sum(f'other{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_user_id_index(self):
+        '''
+        Test UserIdIndex add and discard with a set and a Bloom filter
+        '''
+        for index in [user_index.UserIdIndex(),
+                      user_index.UserIdIndex(bloom_capacity=100)]:
+            index.add('dave03')
+            index.add('evmiles97')
+            self.assertIn('dave03', index)
+            self.assertNotIn('mbak79', index)
+            index.discard('dave03')
+            self.assertNotIn('dave03', index)
+            self.assertIn('evmiles97', index)
+            index.add('dave03')
+            self.assertIn('dave03', index)
+
+    def test_lru_cache(self):
+        '''
+        Test LRUCache eviction, expiry, invalidation and counters
+        '''
+        now = [0.0]
+        lru = cache.LRUCache(maxsize=2, ttl=10.0, clock=lambda: now[0])
+        lru.put('dave03', {'user_id': 'dave03'})
+        lru.put('evmiles97', {'user_id': 'evmiles97'})
+        self.assertEqual(lru.get('dave03'), {'user_id': 'dave03'})
+        # evmiles97 is least recently used and gets evicted
+        lru.put('mbak79', {'user_id': 'mbak79'})
+        self.assertIsNone(lru.get('evmiles97'))
+        self.assertIsNotNone(lru.get('mbak79'))
+        lru.invalidate('mbak79')
+        self.assertIsNone(lru.get('mbak79'))
+        lru.invalidate_if(lambda user: user['user_id'] == 'dave03')
+        self.assertIsNone(lru.get('dave03'))
+        # Entries expire after ttl seconds
+        lru.put('dave03', {'user_id': 'dave03'})
+        now[0] = 11.0
+        self.assertIsNone(lru.get('dave03'))
+        self.assertEqual(lru.stats(), {'size': 0, 'maxsize': 2, 'hits': 2,
+                                       'misses': 4, 'evictions': 1})
+
+    def test_cache_invalidation(self):
+        '''
+        Tests that single-record writes drop the records they change from
+        the cache
+        '''
+        user_collection = stub_collection(
+            users.UserCollection,
+            [{'user_id': user_id, 'user_email': f'{user_id}@uw.edu',
+              'user_name': 'Ann', 'user_last_name': 'Lee'} for user_id in ['u1', 'u2']],
+            cache.LRUCache())
+        for user_id in ['u1', 'u2']:
+            user_collection.search_user(user_id)
+        self.assertEqual(user_collection.cache.stats()['size'], 2)
+        user_collection.modify_user('u1', 'new@uw.edu', 'Ann', 'Lee')
+        self.assertIsNone(user_collection.cache.get('u1'))
+        self.assertEqual(user_collection.search_user('u1').user_email, 'new@uw.edu')
+        user_collection.delete_user('u2')
+        self.assertIsNone(user_collection.cache.get('u2'))
+        self.assertIsNone(user_collection.search_user('u2'))
+
+        status_collection = stub_collection(
+            user_status.UserStatusCollection,
+            [{'status_id': status_id, 'user_id': user_id, 'status_text': 'hi'}
+             for status_id, user_id in [('u1_1', 'u1'), ('u1_2', 'u1'),
+                                        ('u2_1', 'u2'), ('u3_1', 'u3')]],
+            cache.LRUCache())
+        for status_id in ['u1_1', 'u1_2', 'u2_1', 'u3_1']:
+            status_collection.search_status(status_id)
+        status_collection.modify_status('u3_1', 'u3', 'bye')
+        self.assertIsNone(status_collection.cache.get('u3_1'))
+        self.assertEqual(status_collection.search_status('u3_1').status_text, 'bye')
+        status_collection.delete_status('u2_1')
+        self.assertIsNone(status_collection.cache.get('u2_1'))
+        self.assertIsNone(status_collection.search_status('u2_1'))
+        self.assertEqual(status_collection.delete_user_statuses('u1'), 2)
+        self.assertIsNone(status_collection.cache.get('u1_1'))
+        self.assertIsNone(status_collection.cache.get('u1_2'))
+        self.assertIsNotNone(status_collection.cache.get('u3_1'))
+
+    def test_apply_batch(self):
+        '''
+        Test apply_batch keeps results aligned with the input records
+        '''
+        batch = [('dave03', 'david.yuen@gmail.com', 'David', 'Yuen'),
+                   ('bad id', 'david.yuen@gmail.com', 'David', 'Yuen'),
+                   ('evmiles97', 'eve.miles@uw.edu', 'Eve', 'Miles')]
+        received = []
+
+        def operation(valid_records):
+            received.extend(valid_records)
+            return [True, False]
+        results = main.apply_batch(batch,
+                                   lambda record: main.validate_user_inputs(*record),
+                                   operation)
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(received, [batch[0], batch[2]])
+
+    def test_async_user_collection(self):
+        '''
+        Test AsyncUserCollection awaits the wrapped collection methods
+        '''
+        class FakeUsers:
+            '''
+            Records calls instead of using a database
+            '''
+            def search_user(self, user_id):
+                '''
+                Returns a fake user
+                '''
+                return {'user_id': user_id}
+
+        async def search_many():
+            collection = async_main.AsyncUserCollection(FakeUsers())
+            results = await asyncio.gather(*[collection.search_user(f'user{i}')
+                                             for i in range(200)])
+            collection.runner.shutdown()
+            return results
+        results = asyncio.run(search_many())
+        self.assertEqual(len(results), 200)
+        self.assertEqual(results[5], {'user_id': 'user5'})
+
+    def test_validation_checks(self):
+        '''
+        Test the compiled checks give the same results as main's validators
+        '''
+        values = ['dave03', '123141', 'asdf 123', ' 12', '1_000', '+7', '-3\n',
+                  'dave03_00001', 'asdf_1231_1231', 'dave03_hello', 'dave03_ 12',
+                  'mbakke53_12.124', '_1', 'Marcus-3000', "O'Neil", 'Anne-Marie',
+                  'marcusabakke@gmail.com', 'marcus@gmail', 'andy.miles@uw.edu\n',
+                  '', ' ', '\u0663', '1\x1c', '\x1f2', '3\u2003', 'a_0\x1c', 'a_\x1d0']
+        pairs = [(main.validate_user_id, validation.is_user_id),
+                 (main.validate_status_id, validation.is_status_id),
+                 (main.validate_name, validation.is_name),
+                 (main.validate_email, validation.is_email)]
+        for value in values:
+            for expected, compiled in pairs:
+                self.assertEqual(expected(value), compiled(value), (value, compiled))
+
+    def test_record_validator(self):
+        '''
+        Test RecordValidator row, batch and column validation
+        '''
+        rows = [{'STATUS_ID': 'dave03_00001', 'USER_ID': 'dave03',
+                 'STATUS_TEXT': 'Sunny in Seattle this morning'},
+                {'STATUS_ID': 'dave03_hello', 'USER_ID': 'dave03',
+                 'STATUS_TEXT': 'Hello'},
+                {'STATUS_ID': 'dave03_00002', 'USER_ID': '  ',
+                 'STATUS_TEXT': 'Hello'},
+                {'STATUS_ID': 'dave03_00003', 'USER_ID': 'dave03'}]
+        documents, failures = validation.STATUS_VALIDATOR.validate_rows(rows)
+        self.assertEqual(documents, [{'_id': 'dave03_00001',
+                                      'status_id': 'dave03_00001',
+                                      'user_id': 'dave03',
+                                      'status_text': 'Sunny in Seattle this morning',
+                                      'status_seq': 1}])
+        self.assertEqual(failures, [(1, 'STATUS_ID', 'invalid value'),
+                                    (2, 'USER_ID', 'empty value'),
+                                    (3, None, 'unexpected columns')])
+        columns = {'USER_ID': ['dave03', '123'],
+                   'EMAIL': ['david.yuen@gmail.com', 'eve.miles@uw.edu'],
+                   'NAME': ['David', 'Eve'],
+                   'LASTNAME': ['Yuen', 'Miles']}
+        self.assertEqual(validation.USER_VALIDATOR.validate_columns(columns), [1])
+
+    def test_index_matches(self):
+        '''
+        Test index_matches compares keys and uniqueness
+        '''
+        model = indexes.USER_INDEXES[0]
+        self.assertTrue(indexes.index_matches({'key': [('user_id', 1)], 'unique': True},
+                                              model))
+        self.assertFalse(indexes.index_matches({'key': [('user_id', 1)]}, model))
+        self.assertFalse(indexes.index_matches({'key': [('user_id', -1)], 'unique': True},
+                                               model))
+        self.assertFalse(indexes.index_matches(None, model))
+        text_model = indexes.STATUS_INDEXES[2]
+        self.assertTrue(indexes.index_matches({'key': [('_fts', 'text'), ('_ftsx', 1)],
+                                               'weights': {'status_text': 1}},
+                                              text_model))
+
+    def test_status_sequence(self):
+        '''
+        Test status_sequence extracts the numeric suffix of a status_id
+        '''
+        self.assertEqual(user_status.status_sequence('dave03_00012'), 12)
+        self.assertIsNone(user_status.status_sequence('dave03'))
+        self.assertIsNone(user_status.status_sequence('dave03_hello'))
+
+    def test_user_statuses(self):
+        '''
+        Test user_statuses pages by status_seq then status_id, with
+        statuses stored without status_seq first
+        '''
+        statuses = [{'status_id': status_id, 'user_id': 'u',
+                     'status_seq': user_status.status_sequence(status_id)}
+                    for status_id in ['u_3', 'u_2', 'u_1', 'u_02']]
+        statuses += [{'status_id': 'u_5', 'user_id': 'u'},
+                     {'status_id': 'u_4', 'user_id': 'u'},
+                     {'status_id': 'v_1', 'user_id': 'v', 'status_seq': 1}]
+        collection = FakeCollection(FakeFindDatabase(statuses))
+        found = user_status.UserStatusCollection.user_statuses(collection, 'u', 2)
+        self.assertEqual([status['status_id'] for status in found],
+                         ['u_4', 'u_5', 'u_1', 'u_02', 'u_2', 'u_3'])
+
+    def test_search_text(self):
+        '''
+        Tests that search_text yields pages of page_size statuses in
+        textScore order, with the projected fields and the limit
+        '''
+        statuses = [{'_id': status_id, 'status_id': status_id, 'user_id': 'u',
+                     'status_text': text, 'status_seq': 1}
+                    for status_id, text in [('u_1', 'red bike'),
+                                            ('u_2', 'red red bike shop'),
+                                            ('u_3', 'blue car'),
+                                            ('u_4', 'bike shop'),
+                                            ('u_5', 'red shop')]]
+        database = FakeFindDatabase(statuses)
+        collection = FakeCollection(database)
+        pages = list(user_status.UserStatusCollection.search_text(
+            collection, 'red bike shop', page_size=2))
+        self.assertEqual([[status['status_id'] for status in page] for page in pages],
+                         [['u_2', 'u_1'], ['u_4', 'u_5']])
+        self.assertEqual(pages[0][0], {'status_id': 'u_2', 'user_id': 'u',
+                                       'status_text': 'red red bike shop',
+                                       'score': 3})
+        self.assertEqual(database.queries[0], {'$text': {'$search': 'red bike shop'}})
+        self.assertEqual(database.options[0], {'batch_size': 2, 'limit': 0})
+        pages = list(user_status.UserStatusCollection.search_text(
+            collection, 'red bike shop', page_size=2, limit=3))
+        self.assertEqual([[status['status_id'] for status in page] for page in pages],
+                         [['u_2', 'u_1'], ['u_4']])
+        self.assertEqual(database.options[1], {'batch_size': 2, 'limit': 3})
+        self.assertEqual(list(user_status.UserStatusCollection.search_text(
+            collection, 'train', page_size=2)), [])
+
+    def test_backfill_status_seq(self):
+        '''
+        Tests that the status_seq backfill matches status_sequence for
+        every legacy status_id
+        '''
+        class FakeLegacyStatuses:
+            '''
+            Stands in for the StatusUpdates pymongo collection
+            '''
+            name = 'StatusUpdates'
+
+            def __init__(self, status_ids):
+                self.documents = [{'_id': i, 'status_id': status_id}
+                                  for i, status_id in enumerate(status_ids)]
+                self.requests = []
+
+            def find(self, query, projection, batch_size):
+                '''
+                Returns the statuses without status_seq
+                '''
+                # pylint: disable=W0613
+                return iter([document for document in self.documents
+                             if 'status_seq' not in document])
+
+            def bulk_write(self, requests, ordered=True):
+                '''
+                Records one batch of updates
+                '''
+                # pylint: disable=W0613
+                self.requests.append(requests)
+
+        status_ids = ['dave03_ 12', 'dave03_+7', 'dave03_\u0663', 'dave03_99999999999',
+                      'dave03_hello']
+        collection = FakeLegacyStatuses(status_ids)
+        self.assertEqual(migrations.backfill_status_seq(collection, batch_size=2), 5)
+        self.assertEqual([len(requests) for requests in collection.requests], [2, 2, 1])
+        expected = [pymongo.UpdateOne({'_id': i}, {'$set': {'status_seq': seq}})
+                    for i, seq in enumerate([12, 7, 3, 99999999999, None])]
+        self.assertEqual(sum(collection.requests, []), expected)
+
+    def test_datagen(self):
+        '''
+        Test generated data is deterministic, valid and has the requested
+        fraction of invalid and duplicate rows
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            users_file, statuses_file, user_count = datasets.build('1k', directory)
+            self.assertEqual(user_count, 10)
+            for filename, validator in [(users_file, validation.USER_VALIDATOR),
+                                        (statuses_file, validation.STATUS_VALIDATOR)]:
+                with open(filename, 'r', encoding='utf-8') as file:
+                    _, failures = validator.validate_rows(csv.DictReader(file))
+                self.assertEqual(failures, [])
+        rows = list(datagen.generate_statuses(10000, 100, seed=3, invalid=0.05,
+                                              duplicates=0.05))
+        self.assertEqual(rows, list(datagen.generate_statuses(10000, 100, seed=3,
+                                                              invalid=0.05,
+                                                              duplicates=0.05)))
+        status_rows = [dict(zip(datagen.STATUS_HEADER, row)) for row in rows]
+        documents, failures = validation.STATUS_VALIDATOR.validate_rows(status_rows)
+        self.assertAlmostEqual(len(failures) / 10000, 0.05, delta=0.01)
+        duplicates = len(documents) - len({doc['status_id'] for doc in documents})
+        self.assertAlmostEqual(duplicates / 10000, 0.05, delta=0.01)
+
+    def test_instrumentation(self):
+        '''
+        Test timed() records calls and errors in latency histograms
+        '''
+        @instrumentation.timed('test.operation')
+        def operation(fail):
+            if fail:
+                raise ValueError('failed')
+            return 'done'
+        self.assertEqual(operation(False), 'done')
+        with self.assertRaises(ValueError):
+            operation(True)
+        stats = instrumentation.snapshot()['test.operation']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['errors'], 1)
+        self.assertLessEqual(stats['p50_ms'], stats['max_ms'])
+        instrumentation.METRICS.reset()
+        self.assertEqual(instrumentation.snapshot()['test.operation']['count'], 0)
+        operation(False)
+        self.assertEqual(instrumentation.snapshot()['test.operation']['count'], 1)
+        histogram = instrumentation.LatencyHistogram()
+        for _ in range(99):
+            histogram.record(0.001)
+        histogram.record(1.0)
+        self.assertLess(histogram.snapshot()['p95_ms'], 2.1)
+        self.assertEqual(histogram.snapshot()['max_ms'], 1000.0)
+
+    def test_info_sampler(self):
+        '''
+        Test InfoSampler samples and rate-limits only per-record INFO
+        records
+        '''
+        def record(level, name=log_config.RECORD_LOGGER):
+            return logging.LogRecord(name, level, __file__, 1, 'message', None, None)
+        sampler = log_config.InfoSampler(sample_rate=0.25)
+        kept = [sampler.filter(record(logging.INFO)) for _ in range(8)]
+        self.assertEqual(kept.count(True), 2)
+        self.assertTrue(sampler.filter(record(logging.ERROR)))
+        self.assertTrue(all(sampler.filter(record(logging.INFO, 'root')) for _ in range(8)))
+        self.assertIs(users.RECORD_LOG, user_status.RECORD_LOG)
+        self.assertEqual(users.RECORD_LOG.name, log_config.RECORD_LOGGER)
+        now = [0.0]
+        limiter = log_config.InfoSampler(max_per_second=3, clock=lambda: now[0])
+        kept = [limiter.filter(record(logging.INFO)) for _ in range(5)]
+        self.assertEqual(kept, [True, True, True, False, False])
+        now[0] = 1.0
+        self.assertTrue(limiter.filter(record(logging.INFO)))
+
+    def test_export_users(self):
+        '''
+        Test export_users writes gzip CSV in the layout load_users reads
+        '''
+        class FakeExportDatabase:
+            '''
+            Returns fixed documents instead of using a database
+            '''
+            def find(self, query, projection, batch_size):
+                '''
+                Yields the projected fields of two users
+                '''
+                # pylint: disable=W0613
+                yield {'user_id': 'dave03', 'user_email': 'david.yuen@gmail.com',
+                       'user_name': 'David', 'user_last_name': 'Yuen'}
+                yield {'user_id': 'evmiles97', 'user_email': 'eve.miles@uw.edu',
+                       'user_name': 'Eve', 'user_last_name': 'Miles'}
+
+        class FakeUsers:
+            '''
+            Stands in for UserCollection
+            '''
+            name = 'UserAccounts'
+            database = FakeExportDatabase()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'users.csv.gz')
+            self.assertTrue(main.export_users(filename, FakeUsers()))
+            with gzip.open(filename, 'rt', encoding='utf-8') as file:
+                documents, failures = validation.USER_VALIDATOR.validate_rows(
+                    csv.DictReader(file))
+        self.assertEqual(failures, [])
+        self.assertEqual([document['user_id'] for document in documents],
+                         ['dave03', 'evmiles97'])
+        with tempfile.TemporaryDirectory(suffix='.jsonl') as directory:
+            for name in ('users', 'u.csv.bz2', 'u.json', 'u.xml', 'u.gz'):
+                self.assertFalse(main.export_users(os.path.join(directory, name),
+                                                   FakeUsers()))
+                self.assertFalse(os.path.exists(os.path.join(directory, name)))
+            self.assertEqual(exports.export_format('out.csv/u.JSONL.zst'), ('jsonl', 'zstd'))
+            self.assertEqual(exports.export_format('u.csv.gz', compression='zstd'),
+                             ('csv', 'zstd'))
+            filename = os.path.join(directory, 'users')
+            self.assertTrue(main.export_users(filename, FakeUsers(), fmt='csv'))
+            with open(filename, encoding='utf-8') as file:
+                self.assertEqual(file.readline(), 'USER_ID,NAME,LASTNAME,EMAIL\n')
+            self.assertFalse(main.export_users(filename, FakeUsers(), fmt='xml'))
+            self.assertFalse(main.export_users(filename, FakeUsers(),
+                                               compression='bz2'))
+            os.remove(filename)
+            self.assertFalse(main.export_users(filename, FakeUsers(), fmt='json'))
+            self.assertFalse(os.path.exists(filename))
+
+    def test_content_hash(self):
+        '''
+        Tests that content_hash changes with any user field
+        '''
+        user = {'user_id': 'dave03', 'user_email': 'david.yuen@gmail.com',
+                'user_name': 'David', 'user_last_name': 'Yuen'}
+        digest = users.content_hash(user)
+        self.assertEqual(digest, users.content_hash(dict(user)))
+        self.assertNotEqual(digest, users.content_hash(dict(user, user_name='Dave')))
+        row = {'USER_ID': 'dave03', 'EMAIL': 'david.yuen@gmail.com',
+               'NAME': 'David', 'LASTNAME': 'Yuen'}
+        document, _ = validation.USER_VALIDATOR(row)
+        self.assertEqual(document['content_hash'], digest)
+
+    def test_sync_users(self):
+        '''
+        Tests that a snapshot sync writes only new and changed users and
+        deletes missing ones unless the snapshot has invalid rows
+        '''
+        rows = account_rows(4)
+        stored = [validation.USER_VALIDATOR(dict(zip(datagen.USER_HEADER, row)))[0]
+                  for row in rows[:3]]
+        stored[1]['user_name'] = 'Old'
+        users.add_content_hash(stored[1])
+        del stored[2]['content_hash']
+        stored = [{key: value for key, value in user.items() if key != '_id'}
+                  for user in stored] + [{'user_id': 'gone'}]
+        user_collection = stub_collection(users.UserCollection, stored)
+        user_collection.mongo = contextlib.nullcontext()
+        statuses = stub_collection(user_status.UserStatusCollection,
+                                   [{'status_id': 'gone_1', 'user_id': 'gone'},
+                                    {'status_id': 'user0_1', 'user_id': 'user0'}])
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.csv')
+            write_accounts(filename, rows)
+            success, counts = main.sync_users(filename, user_collection, batch_size=2,
+                                              delete_missing=True,
+                                              status_collection=statuses)
+            self.assertTrue(success)
+            self.assertEqual(counts, {'inserted': 1, 'updated': 2, 'unchanged': 1,
+                                      'deleted': 1, 'invalid': 0})
+            documents = {user['user_id']: user for user in user_collection.database.documents}
+            self.assertEqual(sorted(documents), ['user0', 'user1', 'user2', 'user3'])
+            self.assertEqual(documents['user1']['user_name'], 'Eve')
+            self.assertIn('content_hash', documents['user2'])
+            self.assertNotIn('_id', documents['user0'])
+            self.assertEqual(documents['user3']['_id'], 'user3')
+            self.assertEqual(user_collection.database.updated,
+                             [{'user_id': 'user1'}, {'user_id': 'user2'},
+                              {'user_id': 'user3'}])
+            self.assertEqual([status['status_id'] for status in statuses.database.documents],
+                             ['user0_1'])
+            write_accounts(filename, rows[1:3] + [['bad id', 'Eve', 'Miles', 'eve@uw.edu']])
+            success, counts = main.sync_users(filename, user_collection, batch_size=2,
+                                              delete_missing=True,
+                                              status_collection=statuses)
+            self.assertFalse(success)
+            self.assertEqual(counts, {'inserted': 0, 'updated': 0, 'unchanged': 2,
+                                      'deleted': 0, 'invalid': 1})
+            self.assertEqual(len(user_collection.database.documents), 4)
+        user_collection.key = '_id'
+        self.assertEqual(user_collection.upsert(documents['user3']),
+                         {'$set': {key: value for key, value in documents['user3'].items()
+                                   if key != '_id'}})
+
+    def test_write_buffer(self):
+        '''
+        Tests that WriteBuffer batches items and resolves their futures
+        '''
+        batches = []
+
+        def write(items):
+            batches.append(list(items))
+            return [item % 2 == 0 for item in items]
+        with write_buffer.WriteBuffer(write, max_items=3, interval=60) as buffer:
+            futures = [buffer.submit(item) for item in range(5)]
+            self.assertEqual(batches, [[0, 1, 2]])
+            self.assertFalse(futures[3].done())
+        self.assertEqual(batches, [[0, 1, 2], [3, 4]])
+        self.assertEqual([future.result() for future in futures],
+                         [True, False, True, False, True])
+        self.assertRaises(RuntimeError, buffer.submit, 5)
+        with write_buffer.WriteBuffer(write, interval=0.01) as buffer:
+            self.assertTrue(buffer.submit(6).result(timeout=5))
+        self.assertFalse(write_buffer.submit(buffer, (7,), lambda item: False).result())
+        restarted = write_buffer.start(buffer, write, interval=60)
+        self.assertIsNot(restarted, buffer)
+        self.assertIs(write_buffer.start(restarted, write), restarted)
+        with restarted:
+            future = write_buffer.submit(restarted, 8, None)
+        self.assertTrue(future.result())
+
+    def test_cli(self):
+        '''
+        Tests the command line parser and its input helpers
+        '''
+        args = cli.parse_args(['--batch-size', '2', 'delete', 'users',
+                               'dave03', 'evmiles97', '--cascade'])
+        self.assertEqual((args.command, args.kind, args.cascade), ('delete', 'users', True))
+        self.assertEqual(list(cli.read_ids(args)), ['dave03', 'evmiles97'])
+        self.assertEqual(list(cli.batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        args = cli.parse_args(['--port', '27018', 'bench', '--scale', '100k'])
+        self.assertEqual(args.bench_args, ['--scale', '100k'])
+        self.assertEqual(cli.bench_argv(args), ['--host', '127.0.0.1', '--port', '27018',
+                                                '--scale', '100k'])
+        args = cli.parse_args(['--database', 'scratch', 'bench'])
+        self.assertEqual(cli.bench_argv(args)[-2:], ['--database', 'scratch'])
+        args = cli.parse_args(['migrate', '--offline'])
+        self.assertEqual((args.offline, args.drop_indexes), (True, False))
+        self.assertIn('100k', datasets.SCALES)
+
+    def test_bench_database(self):
+        '''
+        Tests that the benchmarks refuse to drop a database not ending in
+        _bench without --force
+        '''
+        with patch('socialnetwork_db.MongoDBConnection') as connection:
+            with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+                cli.main_cli(['--database', 'media', 'bench'])
+            connection.assert_not_called()
+        mongo = types.SimpleNamespace(database='media')
+        with self.assertRaises(ValueError):
+            bench.run(mongo, '1k', 1, 'unused')
+        with patch('benchmarks.datasets.build', side_effect=RuntimeError) as build:
+            with self.assertRaises(RuntimeError):
+                bench.run(mongo, '1k', 1, 'unused', force=True)
+            build.assert_called_once()
+
+    def test_records(self):
+        '''
+        Tests that records build from documents and read like dicts
+        '''
+        user = records.User.from_document({'_id': 1, 'user_id': 'dave03',
+                                           'user_email': 'david.yuen@gmail.com',
+                                           'user_name': 'David', 'user_last_name': 'Yuen',
+                                           'content_hash': 'abc'})
+        self.assertEqual((user.user_id, user.email, user['user_name']),
+                         ('dave03', 'david.yuen@gmail.com', 'David'))
+        self.assertEqual(user[0], 'dave03')
+        self.assertEqual(dict(user), {'user_id': 'dave03',
+                                      'user_email': 'david.yuen@gmail.com',
+                                      'user_name': 'David', 'user_last_name': 'Yuen'})
+        self.assertRaises(KeyError, lambda: user['_id'])
+        self.assertIsNone(user.get('_id'))
+        self.assertIsNone(records.Status.from_document(None))
+        self.assertEqual(records.Status.projection(),
+                         {'_id': 0, 'status_id': 1, 'user_id': 1, 'status_text': 1})
+
+    def test_migrations(self):
+        '''
+        Tests schema version keys, indexes and moving documents to natural keys
+        '''
+        self.assertEqual(migrations.key_field('UserAccounts', 1), 'user_id')
+        self.assertEqual(migrations.key_field('StatusUpdates', 2), '_id')
+        self.assertEqual(migrations.declared_indexes('UserAccounts',
+                                                     indexes.USER_INDEXES, 1),
+                         indexes.USER_INDEXES)
+        names = [model.document['name'] for model in migrations.declared_indexes(
+            'StatusUpdates', indexes.STATUS_INDEXES, 2)]
+        self.assertEqual(names, ['user_id_1_status_seq_1_status_id_1', 'status_text_text'])
+
+        class FakeIndexCollection:
+            '''
+            Stands in for a pymongo collection
+            '''
+            name = 'UserAccounts'
+            deleted = inserted = None
+
+            def delete_many(self, query, session=None):
+                '''
+                Records the deleted _ids
+                '''
+                self.deleted = (query['_id']['$in'], session)
+
+            def insert_many(self, documents, ordered=True, session=None):
+                '''
+                Records the inserted documents
+                '''
+                self.inserted = (documents, ordered, session)
+        collection = FakeIndexCollection()
+        old = [{'_id': 1, 'user_id': 'dave03'}, {'_id': 2, 'user_id': 'evmiles97'}]
+        self.assertEqual(migrations.move_documents(collection, old), 2)
+        self.assertEqual(collection.deleted, ([1, 2], None))
+        self.assertEqual(collection.inserted[0], [{'_id': 'dave03', 'user_id': 'dave03'},
+                                                  {'_id': 'evmiles97',
+                                                   'user_id': 'evmiles97'}])
+
+    def test_migration_safety(self):
+        '''
+        Tests that schema versions are cached per process and that moving
+        documents without transactions needs offline=True
+        '''
+        class FakeSchemaDatabase(dict):
+            '''
+            Stands in for a pymongo database
+            '''
+            name = 'media'
+            client = object()
+
+        class FakeOldCollection:
+            '''
+            Stands in for a pymongo collection of version 1 documents
+            '''
+            name = 'UserAccounts'
+            full_name = 'media.UserAccounts'
+            lookups = 0
+
+            def __init__(self, documents):
+                self.documents = documents
+                self.database = FakeSchemaDatabase()
+
+            def find_one(self, query, projection=None):
+                '''
+                Counts the lookups and returns the first document
+                '''
+                # pylint: disable=W0613
+                self.lookups += 1
+                return self.documents[0] if self.documents else None
+
+            def find(self, query=None, session=None):
+                '''
+                Returns a cursor over the documents
+                '''
+                # pylint: disable=W0613
+                return FakeFindCursor(list(self.documents))
+
+        versions = FakeOldCollection([])
+        old = FakeOldCollection([{'_id': 1, 'user_id': 'dave03'}])
+        database = FakeSchemaDatabase({migrations.SCHEMA_COLLECTION: versions,
+                                       'UserAccounts': old})
+        self.assertEqual(migrations.schema_version(database, 'UserAccounts'), 1)
+        self.assertEqual(migrations.schema_version(database, 'UserAccounts'), 1)
+        self.assertEqual((versions.lookups, old.lookups), (1, 1))
+        old.database['UserAccounts.migration'] = FakeOldCollection([])
+        with patch('socialnetwork_db.supports_transactions', return_value=False):
+            self.assertRaises(RuntimeError, migrations.migrate_natural_keys, old)
+
+    def test_reports(self):
+        '''
+        Tests that reports run pipelines with allowDiskUse and stream results
+        '''
+        calls = []
+
+        class FakeCursor(list):
+            '''
+            Stands in for a CommandCursor
+            '''
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+        class FakeAggregateDatabase:
+            '''
+            Stands in for a pymongo collection
+            '''
+            def aggregate(self, pipeline, **options):
+                '''
+                Records the pipeline and returns canned results
+                '''
+                calls.append((pipeline, options))
+                return FakeCursor([{'user_id': 'dave03', 'user_name': 'David',
+                                    'user_email': 'david.yuen@gmail.com',
+                                    'user_last_name': 'Yuen'}])
+
+        class FakeReportCollection:
+            '''
+            Stands in for UserCollection and UserStatusCollection
+            '''
+            name = 'UserAccounts'
+            key = '_id'
+            database = FakeAggregateDatabase()
+        users_found = main.inactive_users(FakeReportCollection(), FakeReportCollection(), 50)
+        self.assertEqual(calls, [])
+        self.assertEqual([user.user_id for user in users_found], ['dave03'])
+        pipeline, options = calls[0]
+        self.assertEqual(options, {'allowDiskUse': True, 'batchSize': 50})
+        self.assertEqual(pipeline[0], {'$sort': {'_id': 1}})
+        posters = main.top_posters(FakeReportCollection(), FakeReportCollection(), 5)
+        self.assertEqual(calls[1][0][3], {'$limit': 5})
+        self.assertEqual(posters[0]['user_name'], 'David')
+
+    def test_load_collection_batches(self):
+        '''
+        Tests that load_collection flushes fixed-size batches as it reads
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.csv')
+            write_accounts(filename, account_rows(5))
+            collection = FakeCollection()
+            self.assertTrue(loading.load_collection(filename, validation.USER_VALIDATOR,
+                                                 collection, batch_size=2))
+            self.assertEqual(collection.database.calls,
+                             [['user0', 'user1'], ['user2', 'user3'], ['user4']])
+            rows = account_rows(5)
+            rows[3][3] = 'not an email'
+            write_accounts(filename, rows)
+            collection = FakeCollection()
+            self.assertFalse(loading.load_collection(filename, validation.USER_VALIDATOR,
+                                                  collection, batch_size=2))
+            self.assertEqual(collection.database.calls, [['user0', 'user1']])
+
+    def test_insert_batch(self):
+        '''
+        Tests ordered and unordered insert_batch bookkeeping with CSV line
+        numbers
+        '''
+        for ordered, inserted, seen in ((True, 1, ['user0']),
+                                        (False, 2, ['user0', 'user1', 'user2'])):
+            database = FakeDatabase()
+            database.documents['user1'] = {'_id': 'user1'}
+            report = loading.LoadReport('accounts.csv')
+            batch = [{'_id': f'user{i}'} for i in range(3)]
+            inserted_docs = []
+            self.assertFalse(loading.insert_batch(batch, [2, 3, 4], database, report,
+                                               ordered, inserted_docs.extend))
+            self.assertEqual(report.inserted, inserted)
+            self.assertEqual([line for line, _ in report.duplicates], [3])
+            self.assertEqual(report.errors, [])
+            self.assertTrue(report.success)
+            self.assertEqual([doc['_id'] for doc in inserted_docs], seen)
+
+    def test_load_unordered(self):
+        '''
+        Tests that an unordered load inserts every valid row and reports the
+        rest by line
+        '''
+        rows = account_rows(6)
+        rows[2][3] = 'not an email'
+        rows[5] = rows[1]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.csv')
+            write_accounts(filename, rows)
+            collection = FakeCollection()
+            success, report = loading.load_collection(filename, validation.USER_VALIDATOR,
+                                                   collection, batch_size=2, ordered=False)
+            self.assertFalse(success)
+            self.assertEqual(report.inserted, 4)
+            self.assertEqual([line for line, _ in report.errors], [4])
+            self.assertEqual([line for line, _ in report.duplicates], [7])
+            success, report = loading.load_collection(os.path.join(directory, 'missing.csv'),
+                                                   validation.USER_VALIDATOR, collection,
+                                                   ordered=False)
+            self.assertFalse(success)
+            self.assertEqual([line for line, _ in report.errors], [0])
+
+    def test_load_parallel(self):
+        # pylint: disable=R0914
+        '''
+        Tests that split_csv ranges cover the file on line boundaries and
+        that worker reports merge with whole-file line numbers
+        '''
+        class FakeExecutor:
+            '''
+            Runs submitted calls in this process
+            '''
+            def __init__(self, **_):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *_):
+                pass
+
+            def submit(self, function, *args):
+                '''
+                Returns a completed Future for function(*args)
+                '''
+                future = concurrent.futures.Future()
+                future.set_result(function(*args))
+                return future
+
+        rows = account_rows(10)
+        rows[4][3] = 'not an email'
+        rows[9] = rows[0]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.csv')
+            write_accounts(filename, rows)
+            with open(filename, 'rb') as file:
+                header = file.readline()
+                body = file.read()
+            ranges, fieldnames = loading.split_csv(filename, 3)
+            self.assertEqual(fieldnames, list(datagen.USER_HEADER))
+            self.assertEqual(len(ranges), 3)
+            self.assertEqual(ranges[0][0], len(header))
+            self.assertEqual(ranges[-1][1], len(header) + len(body))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(body[start - len(header) - 1:start - len(header)], b'\n')
+            database = FakeDatabase()
+            collection = types.SimpleNamespace(
+                mongo=types.SimpleNamespace(host='127.0.0.1', port=27017, options={}),
+                database=types.SimpleNamespace(database=types.SimpleNamespace(name='test')),
+                name='UserAccounts')
+            client = {'test': {'UserAccounts': database}}
+            with patch('loading.ProcessPoolExecutor', FakeExecutor), \
+                 patch('socialnetwork_db.get_client', return_value=client):
+                success, report = loading.load_collection_parallel(
+                    filename, validation.USER_VALIDATOR, collection, 3, batch_size=2)
+            self.assertFalse(success)
+            self.assertEqual(report.inserted, 8)
+            self.assertEqual([line for line, _ in report.errors], [6])
+            self.assertEqual([line for line, _ in report.duplicates], [11])
+            self.assertEqual(len(database.documents), 8)
+
+    def test_shared_client(self):
+        '''
+        Tests that a shared client is closed only by its last connection
+        '''
+        with patch('socialnetwork_db.MongoClient') as client_class:
+            first = socialnetwork_db.MongoDBConnection(port=27999)
+            second = socialnetwork_db.MongoDBConnection(port=27999)
+            with first, second:
+                self.assertIs(first.connection, second.connection)
+            client = first.connection
+            first.close()
+            client.close.assert_not_called()
+            with second:
+                self.assertIs(second.connection, client)
+            second.close()
+            client.close.assert_called_once()
+            with first:
+                self.assertEqual(client_class.call_count, 2)
+            first.close()
+
+    def test_delete_user_cascade(self):
+        '''
+        Tests that deleting a user deletes their statuses, reports how many
+        and only updates the user index once a transaction commits
+        '''
+        class FakeSession(contextlib.nullcontext):
+            '''
+            Stands in for a pymongo ClientSession
+            '''
+            abort = False
+
+            def __enter__(self):
+                return self
+
+            def with_transaction(self, callback):
+                '''
+                Runs callback, then aborts if abort is set
+                '''
+                result = callback(self)
+                if self.abort:
+                    raise RuntimeError('transaction aborted')
+                return result
+
+        session = FakeSession()
+        client = types.SimpleNamespace(start_session=lambda: session)
+        index = user_index.UserIdIndex()
+        index.add('dave03')
+        user_collection = stub_collection(users.UserCollection,
+                                          [{'user_id': 'dave03'}, {'user_id': 'eve'}],
+                                          index=index)
+        user_collection.mongo = types.SimpleNamespace(connection=client)
+        statuses = stub_collection(user_status.UserStatusCollection,
+                                   [{'status_id': f'dave03_{i}', 'user_id': 'dave03'}
+                                    for i in range(3)] +
+                                   [{'status_id': 'eve_1', 'user_id': 'eve'}])
+        with patch('socialnetwork_db.supports_transactions', return_value=True) as supported:
+            self.assertEqual(main.delete_user_cascade('nobody', user_collection, statuses),
+                             (False, 0))
+            supported.assert_not_called()
+            session.abort = True
+            with self.assertRaises(RuntimeError):
+                main.delete_user_cascade('dave03', user_collection, statuses,
+                                         transaction=True)
+            self.assertIn('dave03', index)
+            session.abort = False
+            user_collection.database.documents.append({'user_id': 'dave03'})
+            self.assertEqual(main.delete_user_cascade('dave03', user_collection, statuses,
+                                                      transaction=True), (True, 0))
+            self.assertNotIn('dave03', index)
+            self.assertEqual(statuses.database.sessions, [session, session])
+            self.assertTrue(main.delete_user('eve', user_collection, statuses))
+        self.assertEqual(statuses.database.sessions[-1], None)
+        self.assertEqual((user_collection.database.documents, statuses.database.documents),
+                         ([], []))
+
+    def test_load_resumable(self):
+        '''
+        Tests that a crashed resumable load continues from its checkpoint
+        with correct line numbers
+        '''
+        rows = account_rows(10)
+        rows[4][3] = 'not an email'
+        rows[9] = rows[0]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'accounts.csv')
+            write_accounts(filename, rows)
+            collection = FakeCollection(FakeDatabase(crash_at=3))
+            with self.assertRaises(RuntimeError):
+                loading.load_collection_resumable(filename, validation.USER_VALIDATOR,
+                                               collection, batch_size=2)
+            with open(filename, 'rb') as file:
+                identity = checkpoints.file_identity(filename, file)
+                lines = file.readlines()
+            state = checkpoints.read_checkpoint(filename + checkpoints.CHECKPOINT_SUFFIX, identity)
+            self.assertEqual((state['line'], state['batches']), (5, 2))
+            self.assertEqual(state['offset'], sum(len(line) for line in lines[:5]))
+            collection.database.crash_at = None
+            success, report = loading.load_collection_resumable(
+                filename, validation.USER_VALIDATOR, collection, batch_size=2)
+            self.assertFalse(success)
+            self.assertEqual([line for line, _ in report.errors], [6])
+            self.assertEqual([line for line, _ in report.duplicates], [7, 11])
+            self.assertEqual(report.inserted, 3)
+            self.assertEqual(len(collection.database.documents), 8)
+            self.assertFalse(os.path.exists(filename + checkpoints.CHECKPOINT_SUFFIX))
+
+    def test_checkpoint(self):
+        '''
+        Tests that load checkpoints round-trip and are tied to their file
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'users.csv')
+            with open(filename, 'w', encoding='utf-8') as file:
+                file.write('USER_ID,NAME,LASTNAME,EMAIL\n')
+            checkpoint_file = filename + checkpoints.CHECKPOINT_SUFFIX
+            with open(filename, 'rb') as file:
+                identity = checkpoints.file_identity(filename, file)
+            self.assertIsNone(checkpoints.read_checkpoint(checkpoint_file, identity))
+            state = dict(identity, offset=28, line=1, batches=0)
+            checkpoints.write_checkpoint(checkpoint_file, state, 512, 11)
+            saved = checkpoints.read_checkpoint(checkpoint_file, identity)
+            self.assertEqual((saved['offset'], saved['line'], saved['batches']),
+                             (512, 11, 1))
+            changed = dict(identity, size=identity['size'] + 1)
+            self.assertIsNone(checkpoints.read_checkpoint(checkpoint_file, changed))
+
     def tearDown(self):
         '''
         Tear Down function to delete saved files
@@ -0,0 +1,84 @@
+'''
+In-memory user_id existence index for the social network project
+
+Used to check that the user of a status exists without querying the
+database once per status.
+'''
+# pylint: disable=R0903
+import hashlib
+import math
+
+
+class BloomFilter:
+    '''
+    Fixed-size Bloom filter of strings
+
+    Membership tests never give false negatives and give false positives
+    at roughly error_rate once capacity keys have been added.
+    '''
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        '''
+        Bit positions of key, using double hashing of one blake2b digest
+        '''
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        '''
+        Adds key to the filter
+        '''
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class UserIdIndex:
+    '''
+    Set of existing user_ids
+
+    Holds an exact set by default. With bloom_capacity, a Bloom filter is
+    used instead to bound memory for very large user bases; deleted ids are
+    kept in a small exact set since a Bloom filter cannot remove keys.
+    '''
+
+    def __init__(self, bloom_capacity=None, error_rate=0.001):
+        if bloom_capacity:
+            self.ids = BloomFilter(bloom_capacity, error_rate)
+            self.removed = set()
+        else:
+            self.ids = set()
+            self.removed = None
+
+    def add(self, user_id):
+        '''
+        Records that user_id exists
+        '''
+        self.ids.add(user_id)
+        if self.removed is not None:
+            self.removed.discard(user_id)
+
+    def discard(self, user_id):
+        '''
+        Records that user_id no longer exists
+        '''
+        if self.removed is None:
+            self.ids.discard(user_id)
+        else:
+            self.removed.add(user_id)
+
+    def __contains__(self, user_id):
+        if self.removed is None:
+            return user_id in self.ids
+        return user_id in self.ids and user_id not in self.removed
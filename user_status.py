@@ -2,9 +2,45 @@
 Classes to manage the user status messages
 All edits by Marcus Bakke.
 '''
-# pylint: disable=R0903
+# pylint: disable=R0902,R0903
 import logging
 import pymongo
+import bulk
+import indexes
+import log_config
+import migrations
+from instrumentation import timed
+from records import Status
+import write_buffer
+
+# Per-record INFO messages, which log_config may sample
+RECORD_LOG = logging.getLogger(log_config.RECORD_LOGGER)
+
+
+def status_sequence(status_id):
+    '''
+    Returns the numeric suffix of status_id, or None if it has none
+
+    Stored as status_seq to order the statuses of a user.
+    '''
+    try:
+        return int(status_id.rsplit('_', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def keyset_after(status_seq, status_id):
+    '''
+    Returns the query for statuses after (status_seq, status_id) in
+    status_seq, status_id order
+
+    A missing status_seq sorts before every number.
+    '''
+    if status_seq is None:
+        return {'$or': [{'status_seq': {'$ne': None}},
+                        {'status_seq': None, 'status_id': {'$gt': status_id}}]}
+    return {'$or': [{'status_seq': {'$gt': status_seq}},
+                    {'status_seq': status_seq, 'status_id': {'$gt': status_id}}]}
 
 
 class UserStatusCollection:
@@ -12,69 +48,298 @@ class UserStatusCollection:
     Collection of UserStatus messages
     '''
 
-    def __init__(self, mongo):
+    def __init__(self, mongo, cache=None):
         logging.info('UserStatusCollection initialized.')
         self.name = 'StatusUpdates'
         self.mongo = mongo
-        data_base = self.mongo.connection.media
+        data_base = self.mongo.connection[self.mongo.database]
         self.database = data_base[self.name]
-        self.database.create_index('status_id', unique=True)
-        self.database.create_index('user_id')
-        self.database.create_index('status_text')
-
+        self.schema_version = migrations.schema_version(data_base, self.name)
+        # Field holding status_id in queries: status_id, or _id once migrated
+        self.key = migrations.key_field(self.name, self.schema_version)
+        self.indexes = migrations.declared_indexes(self.name, indexes.STATUS_INDEXES,
+                                                   self.schema_version)
+        indexes.ensure_indexes(self.database, self.indexes)
+        self.cache = cache
+        self.write_buffer = None
 
+    @timed('user_status.add_status')
     def add_status(self, status_id, user_id, status_text):
         '''
         add a new status message to the collection
         '''
         try:
-            success = self.database.insert_one(dict(status_id=status_id,
+            success = self.database.insert_one(dict(_id=status_id,
+                                                    status_id=status_id,
                                                     user_id=user_id,
-                                                    status_text=status_text))
-            logging.info('Added status %s by %s.', status_id, user_id)
+                                                    status_text=status_text,
+                                                    status_seq=status_sequence(status_id)))
+            RECORD_LOG.info('Added status %s by %s.', status_id, user_id)
             return success
         except pymongo.errors.DuplicateKeyError as exc:
             logging.error('pymongo DuplicateKeyError encountered.')
             logging.error(exc.details['errmsg'])
             return False
 
+    def start_write_behind(self, max_items=1000, interval=0.05):
+        '''
+        Starts batching queue_status calls into add_statuses writes
+
+        See write_buffer.start for the returned WriteBuffer.
+        '''
+        self.write_buffer = write_buffer.start(self.write_buffer, self.add_statuses,
+                                               max_items, interval)
+        return self.write_buffer
+
+    def queue_status(self, status_id, user_id, status_text):
+        '''
+        Adds a new status message through the write-behind buffer
+
+        Returns a Future resolving to True once the status is added or
+        False for a duplicate. Without a started buffer the status is added
+        at once.
+        '''
+        return write_buffer.submit(self.write_buffer, (status_id, user_id, status_text),
+                                   self.add_status)
+
+    @timed('user_status.modify_status')
     def modify_status(self, status_id, user_id, status_text):
         '''
         Modifies a status message
         '''
-        result = self.database.update_one(dict(status_id=status_id),
+        result = self.database.update_one({self.key: status_id},
                                           {'$set': dict(status_id=status_id,
                                                         user_id=user_id,
                                                         status_text=status_text)})
+        if self.cache is not None:
+            self.cache.invalidate(status_id)
         if result.raw_result['n'] == 1:
-            logging.info('Modified status %s by %s to %s.',
-                         status_id,
-                         user_id,
-                         status_text)
+            RECORD_LOG.info('Modified status %s by %s to %s.',
+                            status_id,
+                            user_id,
+                            status_text)
             return True
         logging.error('Unable to modify %s. Status does not exist.', status_id)
         return False
 
+    @timed('user_status.delete_status')
     def delete_status(self, status_id):
         '''
         deletes the status message with id, status_id
         '''
-        result = self.database.delete_one(dict(status_id=status_id))
+        result = self.database.delete_one({self.key: status_id})
+        if self.cache is not None:
+            self.cache.invalidate(status_id)
         if result.raw_result['n'] == 1:
-            logging.info('Deleted status %s.', status_id)
+            RECORD_LOG.info('Deleted status %s.', status_id)
             return True
         logging.error('Unable to delete %s. Status does not exist.', status_id)
         return False
 
+    @timed('user_status.delete_user_statuses')
+    def delete_user_statuses(self, user_id, session=None):
+        '''
+        Deletes every status message posted by user_id
+
+        Uses a single delete_many on the user_id, status_seq index and
+        returns the number of statuses deleted.
+        '''
+        result = self.database.delete_many(dict(user_id=user_id), session=session)
+        if session is None:
+            self.forget_user_statuses(user_id)
+        RECORD_LOG.info('Deleted %i statuses by %s.', result.deleted_count, user_id)
+        return result.deleted_count
+
+    def forget_user_statuses(self, user_id):
+        '''
+        Removes the deleted statuses of user_id from the cache
+
+        delete_user_statuses leaves the cache to the caller when it runs in
+        a session, until the transaction commits.
+        '''
+        if self.cache is not None:
+            self.cache.invalidate_if(lambda status: status['user_id'] == user_id)
+
+    @timed('user_status.search_status')
     def search_status(self, status_id):
         '''
         Find and return a status message by its status_id
 
-        Returns None if status_id does not exist
+        Returns a records.Status, or None if status_id does not exist.
+        Found statuses are served from the cache, when one is set, until
+        they expire or change.
         '''
-        status = self.database.find_one(dict(status_id=status_id))
+        if self.cache is not None:
+            status = self.cache.get(status_id)
+            if status is not None:
+                return status
+        status = Status.from_document(self.database.find_one({self.key: status_id},
+                                                             Status.projection()))
         if status:
-            logging.info('Found status %s.', status_id)
+            RECORD_LOG.info('Found status %s.', status_id)
+            if self.cache is not None:
+                self.cache.put(status_id, status)
         else:
-            logging.info('Status %s not found.', status_id)
+            RECORD_LOG.info('Status %s not found.', status_id)
         return status
+
+    @timed('user_status.add_statuses')
+    def add_statuses(self, records):
+        '''
+        Adds many status messages with one unordered insert_many
+
+        records holds (status_id, user_id, status_text) tuples. Returns a
+        list with True for each added status and False for each duplicate.
+        '''
+        documents = [dict(_id=status_id,
+                          status_id=status_id,
+                          user_id=user_id,
+                          status_text=status_text,
+                          status_seq=status_sequence(status_id))
+                     for status_id, user_id, status_text in records]
+        results = bulk.insert_documents(self.database, documents)
+        logging.info('Added %i of %i statuses.', sum(results), len(results))
+        return results
+
+    @timed('user_status.modify_statuses')
+    def modify_statuses(self, records):
+        '''
+        Modifies many status messages with bulk_write
+
+        records holds (status_id, user_id, status_text) tuples. Returns a
+        list with True for each modified status and False for each status
+        that does not exist.
+        '''
+        updates = {status_id: dict(status_id=status_id,
+                                   user_id=user_id,
+                                   status_text=status_text)
+                   for status_id, user_id, status_text in records}
+        updated = bulk.update_documents(self.database, self.key, updates)
+        if self.cache is not None:
+            for status_id in updates:
+                self.cache.invalidate(status_id)
+        logging.info('Modified %i of %i statuses.', len(updated), len(updates))
+        return [record[0] in updated for record in records]
+
+    @timed('user_status.delete_statuses')
+    def delete_statuses(self, status_ids):
+        '''
+        Deletes many status messages with delete_many
+
+        Returns a list with True for each deleted status and False for each
+        status that does not exist.
+        '''
+        deleted = bulk.delete_documents(self.database, self.key, status_ids)
+        if self.cache is not None:
+            for status_id in deleted:
+                self.cache.invalidate(status_id)
+        logging.info('Deleted %i of %i statuses.', len(deleted), len(status_ids))
+        return [status_id in deleted for status_id in status_ids]
+
+    @timed('user_status.delete_users_statuses')
+    def delete_users_statuses(self, user_ids):
+        '''
+        Deletes every status message posted by any of user_ids
+
+        Returns the number of statuses deleted.
+        '''
+        user_ids = set(user_ids)
+        count = 0
+        for chunk in bulk.chunks(list(user_ids)):
+            count += self.database.delete_many({'user_id': {'$in': chunk}}).deleted_count
+        if self.cache is not None:
+            self.cache.invalidate_if(lambda status: status['user_id'] in user_ids)
+        logging.info('Deleted %i statuses by %i users.', count, len(user_ids))
+        return count
+
+    @timed('user_status.search_statuses')
+    def search_statuses(self, status_ids):
+        '''
+        Finds many status messages with chunked $in queries
+
+        Returns a list with a records.Status, or None, for each status_id.
+        '''
+        found = {}
+        missing = status_ids
+        if self.cache is not None:
+            for status_id in status_ids:
+                status = self.cache.get(status_id)
+                if status is not None:
+                    found[status_id] = status
+            missing = [status_id for status_id in status_ids if status_id not in found]
+        for status_id, status in bulk.find_by_keys(self.database, self.key, missing,
+                                                   Status.projection()).items():
+            found[status_id] = status = Status.from_document(status)
+            if self.cache is not None:
+                self.cache.put(status_id, status)
+        logging.info('Found %i of %i statuses.', len(found), len(status_ids))
+        return [found.get(status_id) for status_id in status_ids]
+
+    def search_text(self, query, page_size=20, limit=0):
+        '''
+        Full-text search of status_text, most relevant first
+
+        Uses the status_text text index and yields pages of at most
+        page_size statuses, each projected to status_id, user_id,
+        status_text and its relevance score. The cursor fetches one page
+        per batch, so large result sets are streamed rather than loaded at
+        once. limit caps the number of results (0 means no limit).
+        '''
+        score = {'$meta': 'textScore'}
+        cursor = self.database.find({'$text': {'$search': query}},
+                                    {'_id': 0,
+                                     'status_id': 1,
+                                     'user_id': 1,
+                                     'status_text': 1,
+                                     'score': score},
+                                    batch_size=page_size,
+                                    limit=limit).sort([('score', score)])
+        logging.info('Searching statuses for "%s".', query)
+        page = []
+        for status in cursor:
+            page.append(status)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def user_statuses(self, user_id, batch_size=100, projection=None, after=None):
+        '''
+        Yields the statuses of user_id in status_id suffix order
+
+        Each batch is a separate keyset query on the user_id, status_seq,
+        status_id index for batch_size statuses after the last one seen, so
+        memory use is constant and no server cursor is held between
+        batches. status_id breaks ties between equal suffixes such as _2
+        and _02. Statuses without status_seq, stored before
+        backfill_status_seq has run or without a numeric suffix, come first
+        in status_id order.
+        projection lists the fields to return; status_seq and status_id
+        are always included. after resumes from the (status_seq,
+        status_id) of the last status seen.
+        '''
+        fields = {'_id': 0, 'status_seq': 1, 'status_id': 1}
+        fields.update({field: 1 for field in projection or
+                       ('status_id', 'user_id', 'status_text')})
+        while True:
+            query = {'user_id': user_id}
+            if after is not None:
+                query.update(keyset_after(*after))
+            batch = list(self.database.find(query, fields)
+                         .sort([('status_seq', pymongo.ASCENDING),
+                                ('status_id', pymongo.ASCENDING)])
+                         .limit(batch_size))
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = (batch[-1].get('status_seq'), batch[-1]['status_id'])
+
+    @timed('user_status.backfill_status_seq')
+    def backfill_status_seq(self):
+        '''
+        Sets status_seq on statuses stored without it
+
+        Runs as schema migration 3. Returns the number of statuses updated.
+        '''
+        return migrations.backfill_status_seq(self.database)
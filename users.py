@@ -2,9 +2,40 @@
 Classes for user information for the social network project
 All edits made by Kathleen Wong to incorporate logging issues.
 '''
-# pylint: disable=R0903
+# pylint: disable=R0902,R0903
+import hashlib
 import logging
 import pymongo
+import bulk
+import indexes
+import log_config
+import migrations
+from instrumentation import timed
+from records import User
+from user_index import UserIdIndex
+import write_buffer
+
+# Per-record INFO messages, which log_config may sample
+RECORD_LOG = logging.getLogger(log_config.RECORD_LOGGER)
+# User fields covered by content_hash, in hashing order
+HASHED_FIELDS = ('user_id', 'user_email', 'user_name', 'user_last_name')
+
+
+def content_hash(user):
+    '''
+    Returns a digest of the user fields, stored as content_hash so a
+    snapshot row can be compared with the stored user without reading it
+    '''
+    content = '\x1f'.join(user[field] for field in HASHED_FIELDS)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def add_content_hash(user):
+    '''
+    Adds the content_hash field to a user document
+    '''
+    user['content_hash'] = content_hash(user)
+    return user
 
 
 class UserCollection:
@@ -12,68 +43,300 @@ class UserCollection:
     Contains a collection of Users objects
     '''
 
-    def __init__(self, mongo):
+    def __init__(self, mongo, cache=None):
         logging.info('UserCollection initialized.')
         self.name = 'UserAccounts'
         self.mongo = mongo
-        data_base = self.mongo.connection.media
+        data_base = self.mongo.connection[self.mongo.database]
         self.database = data_base[self.name]
-        self.database.create_index('user_id', unique=True)
-        self.database.create_index('user_email')
-        self.database.create_index('user_name')
-        self.database.create_index('user_last_name')
+        self.schema_version = migrations.schema_version(data_base, self.name)
+        # Field holding user_id in queries: user_id, or _id once migrated
+        self.key = migrations.key_field(self.name, self.schema_version)
+        self.indexes = migrations.declared_indexes(self.name, indexes.USER_INDEXES,
+                                                   self.schema_version)
+        indexes.ensure_indexes(self.database, self.indexes)
+        self.user_index = None
+        self.cache = cache
+        self.write_buffer = None
 
+    @timed('users.add_user')
     def add_user(self, user_id, email, user_name, user_last_name):
         '''
         Adds a new user to the collection
         '''
         try:
-            success = self.database.insert_one(dict(user_id=user_id,
-                                                    user_email=email,
-                                                    user_name=user_name,
-                                                    user_last_name=user_last_name))
-            logging.info('Added %s.', user_id)
+            success = self.database.insert_one(add_content_hash(
+                dict(_id=user_id,
+                     user_id=user_id,
+                     user_email=email,
+                     user_name=user_name,
+                     user_last_name=user_last_name)))
+            RECORD_LOG.info('Added %s.', user_id)
+            if self.user_index is not None:
+                self.user_index.add(user_id)
             return success
         except pymongo.errors.DuplicateKeyError as exc:
             logging.error('pymongo DuplicateKeyError encountered.')
             logging.error(exc.details['errmsg'])
             return False
 
+    def start_write_behind(self, max_items=1000, interval=0.05):
+        '''
+        Batches queue_user calls into add_users writes and returns the
+        WriteBuffer, see write_buffer.start
+        '''
+        self.write_buffer = write_buffer.start(self.write_buffer, self.add_users,
+                                               max_items, interval)
+        return self.write_buffer
+
+    def queue_user(self, user_id, email, user_name, user_last_name):
+        '''
+        Adds a new user through the write-behind buffer
+
+        Returns a Future resolving to True once the user is added or False
+        for a duplicate. Without a started buffer the user is added at once.
+        '''
+        return write_buffer.submit(self.write_buffer,
+                                   (user_id, email, user_name, user_last_name),
+                                   self.add_user)
+
+    @timed('users.modify_user')
     def modify_user(self, user_id, email, user_name, user_last_name):
         '''
         Modifies an existing user
         '''
         try:
-            success = self.database.update_one({'user_id': user_id},
-                                               {'$set': {'user_email': email,
-                                                         'user_name': user_name,
-                                                         'user_last_name': user_last_name}})
-            logging.info('Updated %s.', user_id)
+            user = add_content_hash(dict(user_id=user_id,
+                                         user_email=email,
+                                         user_name=user_name,
+                                         user_last_name=user_last_name))
+            success = self.database.update_one({self.key: user_id}, {'$set': user})
+            if self.cache is not None:
+                self.cache.invalidate(user_id)
+            RECORD_LOG.info('Updated %s.', user_id)
             return success
         except pymongo.errors.DuplicateKeyError as exc:
             logging.error('pymongo DuplicateKeyError encountered.')
             logging.error(exc.details['errmsg'])
             return False
 
-    def delete_user(self, user_id):
+    @timed('users.delete_user')
+    def delete_user(self, user_id, session=None):
         '''
         Deletes an existing user
+
+        With a session the cache and user index are left unchanged, so a
+        transaction which aborts cannot make them disagree with the
+        database; call forget_user once it commits.
         '''
-        result = self.database.delete_one(dict(user_id=user_id))
+        result = self.database.delete_one({self.key: user_id}, session=session)
+        if session is None:
+            self.forget_user(user_id)
         if result.raw_result['n'] == 1:
-            logging.info('Deleted user %s.', user_id)
+            RECORD_LOG.info('Deleted user %s.', user_id)
             return True
         logging.error('Unable to delete %s. User does not exist.', user_id)
         return False
 
+    def forget_user(self, user_id):
+        '''
+        Removes a deleted user from the cache and the user index
+        '''
+        if self.cache is not None:
+            self.cache.invalidate(user_id)
+        if self.user_index is not None:
+            self.user_index.discard(user_id)
+
+    @timed('users.search_user')
     def search_user(self, user_id):
         '''
         Searches for user data
+
+        Returns a records.User, or None if user_id does not exist. Found
+        users are served from the cache, when one is set, until they expire
+        or change.
         '''
-        user = self.database.find_one(dict(user_id=user_id))
+        if self.cache is not None:
+            user = self.cache.get(user_id)
+            if user is not None:
+                return user
+        user = User.from_document(self.database.find_one({self.key: user_id},
+                                                         User.projection()))
         if user:
-            logging.info('Found user %s.', user_id)
+            RECORD_LOG.info('Found user %s.', user_id)
+            if self.cache is not None:
+                self.cache.put(user_id, user)
         else:
-            logging.info('User %s not found.', user_id)
+            RECORD_LOG.info('User %s not found.', user_id)
         return user
 
+    @timed('users.add_users')
+    def add_users(self, records):
+        '''
+        Adds many users with one unordered insert_many
+
+        records holds (user_id, email, user_name, user_last_name) tuples.
+        Returns a list with True for each added user and False for each
+        duplicate.
+        '''
+        documents = [add_content_hash(dict(_id=user_id,
+                                           user_id=user_id,
+                                           user_email=email,
+                                           user_name=user_name,
+                                           user_last_name=user_last_name))
+                     for user_id, email, user_name, user_last_name in records]
+        results = bulk.insert_documents(self.database, documents)
+        self.track_inserted([document for document, added in zip(documents, results)
+                             if added])
+        logging.info('Added %i of %i users.', sum(results), len(results))
+        return results
+
+    @timed('users.modify_users')
+    def modify_users(self, records):
+        '''
+        Modifies many existing users with bulk_write
+
+        records holds (user_id, email, user_name, user_last_name) tuples.
+        Returns a list with True for each modified user and False for each
+        user that does not exist.
+        '''
+        updates = {user_id: add_content_hash(dict(user_id=user_id,
+                                                  user_email=email,
+                                                  user_name=user_name,
+                                                  user_last_name=user_last_name))
+                   for user_id, email, user_name, user_last_name in records}
+        updated = bulk.update_documents(self.database, self.key, updates)
+        if self.cache is not None:
+            for user_id in updates:
+                self.cache.invalidate(user_id)
+        logging.info('Updated %i of %i users.', len(updated), len(updates))
+        return [record[0] in updated for record in records]
+
+    @timed('users.delete_users')
+    def delete_users(self, user_ids):
+        '''
+        Deletes many users with delete_many
+
+        Returns a list with True for each deleted user and False for each
+        user that does not exist.
+        '''
+        deleted = bulk.delete_documents(self.database, self.key, user_ids)
+        for user_id in deleted:
+            if self.cache is not None:
+                self.cache.invalidate(user_id)
+            if self.user_index is not None:
+                self.user_index.discard(user_id)
+        logging.info('Deleted %i of %i users.', len(deleted), len(user_ids))
+        return [user_id in deleted for user_id in user_ids]
+
+    @timed('users.search_users')
+    def search_users(self, user_ids):
+        '''
+        Searches for many users with chunked $in queries
+
+        Returns a list with a records.User, or None, for each user_id.
+        '''
+        found = {}
+        missing = user_ids
+        if self.cache is not None:
+            for user_id in user_ids:
+                user = self.cache.get(user_id)
+                if user is not None:
+                    found[user_id] = user
+            missing = [user_id for user_id in user_ids if user_id not in found]
+        for user_id, user in bulk.find_by_keys(self.database, self.key, missing,
+                                               User.projection()).items():
+            found[user_id] = user = User.from_document(user)
+            if self.cache is not None:
+                self.cache.put(user_id, user)
+        logging.info('Found %i of %i users.', len(found), len(user_ids))
+        return [found.get(user_id) for user_id in user_ids]
+
+    @timed('users.sync_users')
+    def sync_users(self, users):
+        '''
+        Upserts the users of a snapshot batch which are new or changed
+
+        users holds validated user documents with content_hash set. The
+        stored hashes are read with chunked $in queries and one unordered
+        bulk_write upserts only the users whose hash differs. Users stored
+        before content_hash existed count as changed once. Returns
+        (inserted, updated, unchanged) counts.
+        '''
+        stored = bulk.find_by_keys(self.database, self.key,
+                                   [user['user_id'] for user in users],
+                                   {'_id': 0, 'content_hash': 1})
+        changed = {}
+        for user in users:
+            current = stored.get(user['user_id'])
+            if current is None or current.get('content_hash') != user['content_hash']:
+                changed[user['user_id']] = user
+        requests = [pymongo.UpdateOne({self.key: user_id}, self.upsert(user), upsert=True)
+                    for user_id, user in changed.items()]
+        for chunk in bulk.chunks(requests):
+            self.database.bulk_write(chunk, ordered=False)
+        inserted = [user for user_id, user in changed.items() if user_id not in stored]
+        self.track_inserted(inserted)
+        if self.cache is not None:
+            for user_id in changed:
+                self.cache.invalidate(user_id)
+        updated = len(changed) - len(inserted)
+        logging.info('Synced %i users: %i added, %i updated.',
+                     len(users), len(inserted), updated)
+        return len(inserted), updated, len(users) - len(changed)
+
+    def upsert(self, user):
+        '''
+        Returns the update setting every field of user
+
+        _id cannot be $set, so a new user gets it through $setOnInsert.
+        '''
+        fields = {key: value for key, value in user.items() if key != '_id'}
+        if self.key == '_id':
+            return {'$set': fields}
+        return {'$set': fields, '$setOnInsert': {'_id': user['user_id']}}
+
+    @timed('users.missing_users')
+    def missing_users(self, user_ids):
+        '''
+        Returns the stored user_ids which are not in the set user_ids
+        '''
+        cursor = self.database.find({}, {'user_id': 1, '_id': 0}, batch_size=10000)
+        return [user['user_id'] for user in cursor if user['user_id'] not in user_ids]
+
+    @timed('users.build_user_index')
+    def build_user_index(self, bloom=False, error_rate=0.001):
+        '''
+        Builds the in-memory user_id index from a projected scan
+
+        With bloom=True a Bloom filter sized for the current collection is
+        used instead of an exact set.
+        '''
+        capacity = None
+        if bloom:
+            # Leave room for users added after the index is built
+            capacity = max(self.database.estimated_document_count(), 1000) * 2
+        index = UserIdIndex(capacity, error_rate)
+        cursor = self.database.find({}, {'user_id': 1, '_id': 0}, batch_size=10000)
+        for user in cursor:
+            index.add(user['user_id'])
+        self.user_index = index
+        logging.info('Built user_id index for %s.', self.name)
+        return index
+
+    def track_inserted(self, users):
+        '''
+        Adds bulk-inserted user documents to the user_id index
+        '''
+        if self.user_index is not None:
+            for user in users:
+                self.user_index.add(user['user_id'])
+
+    @timed('users.user_exists')
+    def user_exists(self, user_id):
+        '''
+        Checks if user_id exists, in memory when the index has been built
+        '''
+        if self.user_index is not None:
+            return user_id in self.user_index
+        return self.database.find_one({self.key: user_id}, {'_id': 1}) is not None
@@ -0,0 +1,133 @@
+'''
+Write-behind batching for single adds
+
+A WriteBuffer collects items submitted one at a time and writes them
+together through a batch function such as UserCollection.add_users, so
+many single adds share one insert_many round trip. The buffer is written
+when it holds max_items items, every interval seconds from a background
+thread, and on close, context exit or interpreter exit. Each submit
+returns a concurrent.futures.Future which resolves to the batch
+function's result for that item: True when added, False for a duplicate.
+'''
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+
+class WriteBuffer:
+    '''
+    Buffers items for a batch write function
+
+    write is called with a list of items and must return one result per
+    item, in order. A submit which fills the buffer writes it on the
+    calling thread, so callers are slowed to the database's pace instead
+    of growing the buffer without bound.
+    '''
+
+    # pylint: disable=R0902
+    def __init__(self, write, max_items=1000, interval=0.05):
+        self.write = write
+        self.max_items = max_items
+        self.interval = interval
+        self.items = []
+        self.futures = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, item):
+        '''
+        Adds item to the buffer and returns a Future for its result
+        '''
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('WriteBuffer is closed')
+            self.items.append(item)
+            self.futures.append(future)
+            full = len(self.items) >= self.max_items
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        '''
+        Writes the buffered items and resolves their futures
+
+        Returns the number of items written. If the write raises, every
+        future of the batch gets the exception.
+        '''
+        with self.write_lock:
+            with self.lock:
+                items, futures = self.items, self.futures
+                self.items, self.futures = [], []
+            if not items:
+                return 0
+            try:
+                results = self.write(items)
+            except Exception as exc:  # pylint: disable=W0718
+                logging.error('Write-behind batch of %i items failed: %s', len(items), exc)
+                for future in futures:
+                    future.set_exception(exc)
+                return len(items)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+            return len(items)
+
+    def run(self):
+        '''
+        Flushes the buffer every interval seconds until closed
+        '''
+        while not self.stopping.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        '''
+        Stops the background thread and writes what is left
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.stopping.set()
+        self.thread.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def start(buffer, write, max_items=1000, interval=0.05):
+    '''
+    Returns buffer if it is still open, or else a new WriteBuffer for write
+
+    Used by the collections' start_write_behind methods. Closing the
+    buffer, or leaving it as a context manager, writes the items still
+    buffered.
+    '''
+    if buffer is None or buffer.closed:
+        buffer = WriteBuffer(write, max_items, interval)
+    return buffer
+
+
+def submit(buffer, record, add):
+    '''
+    Submits record to buffer and returns its Future
+
+    Without an open buffer, record is added at once by add(*record) and
+    the Future is already resolved: True unless add returned False.
+    '''
+    if buffer is None or buffer.closed:
+        future = Future()
+        future.set_result(add(*record) is not False)
+        return future
+    return buffer.submit(record)